@@ -1,13 +1,61 @@
 #!/usr/bin/env python3
 
-from flask import Flask, request, render_template
-from werkzeug.exceptions import NotFound
-from media import Sources
+import json
+import mimetypes
+import os
+import re
+import time
 
+import flask
+from flask import Flask, request, send_file, url_for, jsonify, \
+    make_response, Response, g
+from markupsafe import Markup
+from werkzeug.exceptions import BadRequest, NotFound
+import cfg
+import fragments
+import jobs
+import metrics
+import posters
+from media import Sources, Search
+from watcher import Watcher
 
 app = Flask(__name__)
 
-sources = Sources.get()
+if cfg.separate_indexer:
+    # entries are scanned by `indexer.py`, see `attach_sources`
+    jobs.runner = jobs.QueuedRunner()
+    sources = Sources.attach()
+else:
+    sources = Sources.get()
+    if cfg.watch:
+        Watcher(sources).start()
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.before_request
+def attach_sources():
+    # use entries of the latest catalog generation
+    global sources
+    if cfg.separate_indexer:
+        sources = Sources.attach()
+
+
+@app.after_request
+def record_duration(response):
+    route = request.url_rule.rule if request.url_rule else 'unknown'
+    metrics.request_seconds.observe(time.perf_counter() - g.start,
+                                    route=route)
+    return response
+
+
+@app.route('/metrics')
+def show_metrics():
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/')
@@ -15,6 +63,50 @@ def show_main():
     return render_template('sources.html', sources=sources)
 
 
+@app.route('/search')
+def show_search():
+    query = request.args.get('q', '')
+    search = Search(query, f'search: {query}')
+    if 'entries' in request.args:
+        return entries_page(search)
+    if 'refresh' in request.args:
+        return jsonify(jobs.runner.submit(request.full_path,
+                                          search.refresh).status())
+    names, next = search.page(size=cfg.page_size)
+    return render_collection(search, names, next)
+
+
+@app.route('/poster/<size>/<name>')
+def show_poster(size, name):
+    # serve local copy of poster, which is stored under its content hash
+    # and therefore never changes
+    if size not in posters.sizes:
+        raise NotFound(f'Unknown poster size "{size}".')
+    hash = posters.store.get('/' + name, size)
+    if hash is None:
+        raise NotFound(f'Cannot get poster "{name}".')
+    response = send_file(posters.store.filename(hash),
+                         mimetype='image/jpeg', etag=hash,
+                         max_age=365 * 24 * 60 * 60)
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/jobs/<int:id>')
+def show_job(id):
+    # stream progress of job as server-sent events
+    job = jobs.runner.get(id)
+    if job is None:
+        raise NotFound(f'Cannot find job {id}.')
+
+    def events():
+        for status in job.watch():
+            yield f'data: {json.dumps(status)}\n\n'
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
 @app.route('/<path:path>/')
 def show_path(path):
     # determine entry that should respond to the request
@@ -31,10 +123,24 @@ def show_path(path):
                 entry.open()
                 return 'opened'
                 # triggered by JS `fetch`, response is ignored
+            if key == 'entries':
+                return entries_page(entry)
+                # triggered by JS `fetch` when scrolling or filtering
             if key == 'refresh':
-                entry.refresh()
-                return 'refreshed'
-                # triggered by JS `fetch`, response is ignored
+                job = jobs.runner.submit(request.path, entry.refresh)
+                return jsonify(job.status())
+                # triggered by JS `fetch`, which then follows the job's
+                # progress
+            if key == 'watch':
+                return watch_page(entry, value)
+                # page with a video element for streaming
+            if key == 'stream':
+                return stream_video(entry, value)
+                # requested by the video element, mostly with ranges
+            if key == 'subtitle':
+                return stream_subtitle(entry, value,
+                                       request.args.get('track', ''))
+                # requested by the track elements of the video element
             if key == 'play':
                 entry.play(value)
                 return r'<script>window.history.back();</script>'
@@ -45,17 +151,160 @@ def show_path(path):
                 # up, `url/` → `url/?play` → `url/`, so that going back in
                 # history does not move before `url/`. Solution: Have a
                 # response that triggers going back to the previous page by JS.
-    # render entry
+    # render entry, unless the client has the current version
     type = entry.__class__.__name__
-    if type in ['Collection', 'Source']:
-        return render_template('collection.html', collection=entry)
+    if type in ['Collection', 'Source', 'Search', 'Everything']:
+        names, next = entry.page(size=cfg.page_size)
+        return conditional(page_version(entry, names),
+                           lambda: render_collection(entry, names, next))
     elif type == 'Movie':
-        return render_template('movie.html', movie=entry)
+        return conditional(entry.version,
+                           lambda: render_template('movie.html', movie=entry))
     elif type == 'Series':
-        return render_template('series.html', series=entry)
+        return conditional(page_version(entry, entry),
+                           lambda: render_template('series.html',
+                                                   series=entry))
     elif type == 'Season':
-        return render_template('season.html', season=entry)
-    return render_template('unknown.html', unknown=entry)
+        return conditional(entry.version,
+                           lambda: render_template('season.html',
+                                                   season=entry))
+    return conditional(entry.version,
+                       lambda: render_template('unknown.html', unknown=entry))
+
+
+def page_version(entry, names):
+    # version of a page showing entry and the tiles of its entries `names`
+    return max([entry.version] + [entry[name].version for name in names])
+
+
+def conditional(version, render):
+    # Respond with 304 if the client has the page of this `version`,
+    # otherwise with the page rendered by calling `render`, cached by URL
+    # and version. Versions are more precise than `If-Modified-Since`, so
+    # only the ETag is checked.
+    etag = f'{version:.6f}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(
+            fragments.pages.get((request.full_path, etag), render))
+    response.set_etag(etag)
+    # clients have to check whether their copy is still current
+    response.cache_control.no_cache = True
+    return response
+
+
+def render_collection(collection, names, next):
+    # render collection with the first page of its entries `names` and the
+    # cursor `next` of the second, further pages are loaded by JS
+    return render_template('collection.html', collection=collection,
+                           names=names, next=json.dumps(next) if next else '')
+
+
+def entries_page(collection):
+    # page of entries of collection as JSON, with rendered tiles; see
+    # `Collection.page` for the arguments
+    args = request.args
+    try:
+        cursor = json.loads(args['cursor']) if 'cursor' in args else None
+        names, next = collection.page(cursor,
+                                      sort=args.get('sort', 'date'),
+                                      genre=args.get('genre') or None,
+                                      type=args.get('type') or None,
+                                      size=cfg.page_size)
+    except (ValueError, TypeError) as e:
+        raise BadRequest(str(e))
+    entries = []
+    for name in names:
+        entry = collection[name]
+        entries.append({
+            'name':     name,
+            'type':     entry.type(),
+            'date':     entry.date(),
+            'genres':   sorted(entry.filter_genres()),
+            'html':     render_tile(name, entry),
+        })
+    return jsonify(entries=entries, next=json.dumps(next) if next else None)
+
+
+def video(entry, episode):
+    # get path of the video file of entry, for `episode` if it has episodes
+    if not hasattr(entry, 'video'):
+        raise NotFound('Cannot stream this entry.')
+    try:
+        filename = entry.video(episode)
+    except (ValueError, IndexError):
+        raise NotFound(f'Cannot find episode "{episode}".')
+    if filename is None:
+        raise NotFound('Cannot find video file.')
+    return filename
+
+
+def watch_page(entry, episode):
+    video(entry, episode)
+    subtitles = [os.path.splitext(os.path.basename(filename))[0]
+                 for filename in entry.subtitles(episode)]
+    return render_template('watch.html', entry=entry, episode=episode,
+                           subtitles=subtitles)
+
+
+def stream_video(entry, episode):
+    # Respond with the video file, or the requested range of it. The file is
+    # passed to the WSGI server, which can send it without copying (e.g.
+    # using `sendfile`) if it supports `wsgi.file_wrapper`.
+    filename = video(entry, episode)
+    return send_file(filename, conditional=True,
+                     mimetype=(mimetypes.guess_type(filename)[0]
+                               or 'application/octet-stream'))
+
+
+def stream_subtitle(entry, episode, track):
+    # respond with subtitle file as WebVTT, converted from SubRip if
+    # necessary, and cached
+    video(entry, episode)
+    try:
+        filename = entry.subtitles(episode)[int(track)]
+        st = os.stat(filename)
+    except (ValueError, IndexError, OSError):
+        raise NotFound(f'Cannot find subtitle "{track}".')
+    key = (filename, st.st_mtime_ns, st.st_size)
+    response = Response(fragments.subtitles.get(key,
+                                                lambda: webvtt(filename)),
+                        mimetype='text/vtt')
+    response.set_etag(f'{st.st_mtime_ns}-{st.st_size}')
+    response.last_modified = int(st.st_mtime)
+    return response.make_conditional(request)
+
+
+def webvtt(filename):
+    # read subtitle file, converting SubRip to WebVTT; the encoding of SubRip
+    # files is often not UTF-8
+    with open(filename, 'rb') as f:
+        data = f.read()
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = data.decode('cp1252', errors='replace')
+    if filename.lower().endswith('.vtt'):
+        return text
+    # SubRip differs in the header and the decimal separator of times
+    text = text.replace('\r\n', '\n')
+    text = re.sub(r'(\d\d:\d\d:\d\d),(\d\d\d)', r'\1.\2', text)
+    return 'WEBVTT\n\n' + text
+
+
+def render_template(template, **context):
+    # render template, recording its duration
+    with metrics.render_seconds.time(template=template):
+        return flask.render_template(template, **context)
+
+
+def render_tile(name, entry):
+    # render tile of entry, cached by name, path, type and version
+    key = (name, entry.path, entry.type(), entry.version)
+    return Markup(fragments.tiles.get(
+        key, lambda: render_template('entry_tile.html',
+                                     name=name, entry=entry)))
 
 
 def genre_id(genre):
@@ -63,5 +312,16 @@ def genre_id(genre):
     return genre.translate(str.maketrans('', '', ' &-'))
 
 
+def poster_url(url, size):
+    # translate TMDb poster path to URL of local copy
+    if url is None:
+        return ''
+    return url_for('show_poster', size=size, name=url.lstrip('/'))
+
+
 # register `genre_id` as jinja filter `gid`
 app.jinja_env.filters['gid'] = genre_id
+# register `poster_url` as jinja function `poster`
+app.jinja_env.globals['poster'] = poster_url
+# register `render_tile` as jinja function `tile`
+app.jinja_env.globals['tile'] = render_tile
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+# Benchmark of Idaho on a synthetic library, against a local stand-in for
+# TMDb's API and image server.
+#
+# The library follows the naming schemes described in `notes.md`. Idaho runs
+# twice in a child process, first with an empty configuration directory
+# (cold scan), then again with the catalog and caches of the first run (warm
+# startup). Each run records timings of startup, revalidation, loading and
+# saving the catalog, rendering, and refreshing the largest source, as well as
+# the number of TMDb requests and the peak resident memory. Results are
+# written as JSON.
+#
+#   python bench.py --movies 1000 --latency 50 --output results.json
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+video_extensions = ['.mkv', '.mp4', '.avi']
+
+genres = ['Drama', 'Comedy', 'Action', 'Thriller', 'Documentary',
+          'Science Fiction', 'Romance', 'Animation']
+
+
+def build_library(path, args):
+    # create empty video files in sources `completed` (torrents), `Movies`
+    # (processed movie files and collections) and `Series` (processed series)
+    completed = os.path.join(path, 'completed')
+    movies = os.path.join(path, 'Movies')
+    series = os.path.join(path, 'Series')
+    for i in range(args.movies):
+        # RARBG movie folder with video file and subtitles
+        name = f'Torrent.Movie.{i}.{1950 + i % 70}.1080p.BluRay.x264'
+        folder = os.path.join(completed, name + '-[RARBG]')
+        os.makedirs(os.path.join(folder, 'Subs'))
+        touch(os.path.join(folder, name + '.mp4'))
+        touch(os.path.join(folder, 'Subs', '2_English.srt'))
+    for i in range(args.seasons):
+        # RARBG season folder with episodes
+        name = f'Torrent.Series.{i}.S{1 + i % 3:02}'
+        folder = os.path.join(completed, name + '.1080p.WEB.x264-[RARBG]')
+        os.makedirs(folder)
+        for e in range(args.episodes):
+            touch(os.path.join(
+                folder, f'{name}E{e + 1:02}.1080p.WEB.x264.mkv'))
+    os.makedirs(movies)
+    for i in range(args.files):
+        # processed movie file
+        touch(os.path.join(
+            movies, f'Director {i % 97} - Movie {i} - {1930 + i % 90}.mkv'))
+    for i in range(args.collections):
+        # collection folder with processed movie files
+        folder = os.path.join(movies, f'Saga {i} collection')
+        os.makedirs(folder)
+        for j in range(args.collection_size):
+            touch(os.path.join(
+                folder, f'Director {i} - Saga {i} Part {j} - {1970 + j}.mkv'))
+    os.makedirs(series)
+    for i in range(args.series):
+        # processed series folder with season folders
+        for s in range(1 + i % 4):
+            folder = os.path.join(series, f'Series {i}', f'Season {s + 1}')
+            os.makedirs(folder)
+            for e in range(args.episodes):
+                touch(os.path.join(
+                    folder, f'Series {i} S{s + 1:02}E{e + 1:02}.mkv'))
+
+
+def touch(filename):
+    open(filename, 'w').close()
+
+
+class FakeTMDb(ThreadingHTTPServer):
+    # Stand-in for TMDb's API and image server, answering every request
+    # after `latency` seconds. Titles are found as movies and names as
+    # series, except for names ending in 'collection'; ids are derived from
+    # the query, and details from the id.
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), FakeTMDbHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = {'api': 0, 'images': 0}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def handle_error(self, request, client_address):
+        # clients may exit with requests pending, e.g. for posters
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] += 1
+
+    def respond(self, path, params):
+        parts = path.split('/')
+        if parts[0] == 'search':
+            query = params.get('query', '')
+            id = zlib.crc32(query.encode()) % 1000000
+            if parts[1] == 'movie':
+                return {'results': [{'id': id, 'title': query}]}
+            if query.endswith('collection'):
+                return {'results': []}
+            return {'results': [{'id': id, 'name': query}]}
+        id = int(parts[1])
+        appended = {
+            'credits': {
+                'cast': [{'name': f'Actor {id % 101 + k}', 'order': k}
+                         for k in range(5)],
+                'crew': [{'name': f'Director {id % 97}', 'job': 'Director'},
+                         {'name': f'Writer {id % 89}', 'job': 'Screenplay'}]},
+            'external_ids': {'imdb_id': f'tt{id:07}'},
+        }
+        if len(parts) > 2:
+            return appended[parts[2]]
+        if parts[0] == 'movie':
+            response = {
+                'id': id,
+                'release_date': f'{1930 + id % 90}-{1 + id % 12:02}-01',
+                'original_title': f'Movie {id}',
+                'title': f'Movie {id}',
+                'adult': False,
+                'genres': [{'name': genres[id % len(genres)]},
+                           {'name': genres[id // 7 % len(genres)]}],
+                'runtime': 80 + id % 60,
+                'production_countries': [{'iso_3166_1': 'US'}],
+                'poster_path': f'/movie{id}.jpg',
+                'vote_average': id % 100 / 10,
+            }
+        else:
+            seasons = 1 + id % 4
+            response = {
+                'id': id,
+                'first_air_date': f'{1990 + id % 30}-01-01',
+                'last_air_date': f'{1990 + id % 30 + seasons - 1}-12-01',
+                'original_name': f'Series {id}',
+                'name': f'Series {id}',
+                'number_of_seasons': seasons,
+                'created_by': [{'name': f'Creator {id % 53}'}],
+                'genres': [{'name': genres[id % len(genres)]}],
+                'production_countries': [{'iso_3166_1': 'GB'}],
+                'episode_run_time': [45],
+                'poster_path': f'/series{id}.jpg',
+                'vote_average': id % 100 / 10,
+                'seasons': [{'season_number': s + 1,
+                             'air_date': f'{1990 + id % 30 + s}-01-01',
+                             'name': f'Season {s + 1}',
+                             'poster_path': f'/series{id}s{s + 1}.jpg'}
+                            for s in range(seasons)],
+            }
+        for name in params.get('append_to_response', '').split(','):
+            if name in appended:
+                response[name] = appended[name]
+        return response
+
+
+class FakeTMDbHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urllib.parse.urlsplit(self.path)
+        if url.path.startswith('/t/p/'):
+            self.server.count('images')
+            self.reply('image/jpeg', b'\xff\xd8' + url.path.encode() * 100)
+            return
+        self.server.count('api')
+        params = dict(urllib.parse.parse_qsl(url.query))
+        body = json.dumps(self.server.respond(url.path[len('/3/'):], params))
+        self.reply('application/json', body.encode())
+
+    def reply(self, type, body):
+        self.send_response(200)
+        self.send_header('Content-Type', type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(result):
+    # run Idaho in this process and write timings to file `result`
+    timings = dict()
+
+    start = time.perf_counter()
+    import cfg
+    # time loading and revalidation separately
+    cfg.revalidate_in_background = True
+    import app
+    import fragments
+    from media import Source, walk
+    sources = app.sources
+    timings['startup'] = time.perf_counter() - start
+    start = time.perf_counter()
+    sources.revalidated.wait()
+    timings['revalidate'] = time.perf_counter() - start
+
+    # the largest source and number of entries
+    counts = {name: len(list(walk(sources[name])))
+              for name in sources if isinstance(sources[name], Source)}
+    largest = max(counts, key=counts.get)
+    timings['entries'] = sum(counts.values())
+
+    # catalog
+    start = time.perf_counter()
+    for source in sources.each_source():
+        source.entries = dict()
+        source.saved = dict()
+        source.load()
+    timings['load'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for source in sources.each_source():
+        for _, _, entry in walk(source):
+            entry.dirty = True
+        source.saved = dict()
+        source.save()
+    timings['save'] = time.perf_counter() - start
+
+    # rendering, without and with cached fragments, and revalidated
+    client = app.app.test_client()
+    for name, url in [('main', '/'), ('collection', f'/{largest}/')]:
+        fragments.tiles.fragments.clear()
+        fragments.pages.fragments.clear()
+        start = time.perf_counter()
+        response = client.get(url)
+        timings[f'render_{name}'] = time.perf_counter() - start
+        start = time.perf_counter()
+        client.get(url)
+        timings[f'render_{name}_cached'] = time.perf_counter() - start
+        etag = response.headers.get('ETag')
+        if etag is not None:
+            start = time.perf_counter()
+            client.get(url, headers={'If-None-Match': etag})
+            timings[f'render_{name}_304'] = time.perf_counter() - start
+    start = time.perf_counter()
+    client.get(f'/{largest}/', query_string={'entries': '', 'sort': 'name'})
+    timings['entries_page'] = time.perf_counter() - start
+
+    # refresh of the largest source
+    start = time.perf_counter()
+    sources[largest].refresh()
+    timings['refresh'] = time.perf_counter() - start
+
+    # peak resident memory, in kB on Linux
+    timings['peak_rss_mb'] = (resource.getrusage(resource.RUSAGE_SELF)
+                              .ru_maxrss / 1024)
+
+    with open(result, 'w') as f:
+        json.dump(timings, f)
+
+
+def run(args, workdir, server):
+    # run Idaho twice in a child process and collect results
+    config = os.path.join(workdir, 'config', 'idaho')
+    os.makedirs(config, exist_ok=True)
+    library = os.path.join(workdir, 'library')
+    with open(os.path.join(config, 'config.yaml'), 'w') as f:
+        json.dump({
+            'TMDb_API_key': 'benchmark',
+            'sources': {name: os.path.join(library, name)
+                        for name in ['completed', 'Movies', 'Series']},
+            'video_extensions': video_extensions,
+            'scan_workers': args.workers,
+            'tmdb_rate_limit': args.rate_limit,
+            'log_level': 'warning',
+            'tmdb_base_url': f'http://127.0.0.1:{server.server_port}/3',
+            'tmdb_image_url': f'http://127.0.0.1:{server.server_port}/t/p',
+        }, f)
+    env = dict(os.environ, XDG_CONFIG_HOME=os.path.join(workdir, 'config'))
+    result = os.path.join(workdir, 'result.json')
+    runs = dict()
+    for name in ['cold', 'warm']:
+        print(f'{name} run ...', file=sys.stderr)
+        requests = dict(server.requests)
+        subprocess.run([sys.executable, os.path.abspath(__file__),
+                        '--measure', result],
+                       env=env, check=True, stdout=subprocess.DEVNULL,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        with open(result) as f:
+            runs[name] = json.load(f)
+        runs[name]['tmdb_requests'] = (server.requests['api']
+                                       - requests['api'])
+        runs[name]['image_requests'] = (server.requests['images']
+                                        - requests['images'])
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark Idaho on a synthetic library.')
+    parser.add_argument('--movies', type=int, default=300,
+                        help='number of RARBG movie folders')
+    parser.add_argument('--seasons', type=int, default=30,
+                        help='number of RARBG season folders')
+    parser.add_argument('--files', type=int, default=300,
+                        help='number of processed movie files')
+    parser.add_argument('--collections', type=int, default=10,
+                        help='number of collection folders')
+    parser.add_argument('--collection-size', type=int, default=5,
+                        help='number of movie files per collection')
+    parser.add_argument('--series', type=int, default=30,
+                        help='number of processed series folders')
+    parser.add_argument('--episodes', type=int, default=8,
+                        help='number of episodes per season')
+    parser.add_argument('--latency', type=float, default=20,
+                        help='latency of TMDb stand-in in milliseconds')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='value of setting `scan_workers`')
+    parser.add_argument('--rate-limit', type=int, default=1000,
+                        help='value of setting `tmdb_rate_limit`, high by '
+                        'default so that it does not hide other changes')
+    parser.add_argument('--output', default='bench-results.json',
+                        help='file to write results to')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the library and configuration directory')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        # child process
+        measure(args.measure)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='idaho-bench-')
+    try:
+        build_library(os.path.join(workdir, 'library'), args)
+        server = FakeTMDb(args.latency / 1000)
+        runs = run(args, workdir, server)
+    finally:
+        if args.keep:
+            print('kept', workdir, file=sys.stderr)
+        else:
+            shutil.rmtree(workdir)
+
+    results = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ['output', 'keep', 'measure']},
+        'runs': runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    # summary
+    for key in runs['cold']:
+        print(f'{key:24}' + ''.join(f'{runs[name][key]:12.3f}'
+                                    if isinstance(runs[name][key], float)
+                                    else f'{runs[name][key]:12}'
+                                    for name in runs))
+
+
+if __name__ == '__main__':
+    main()
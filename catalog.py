@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+
+import cfg
+
+
+class Catalog:
+    # SQLite database of the entries of all sources
+    #
+    # Each entry is a row identified by its source's path and its `key`, the
+    # entry's path relative to the source's path ('' for the source itself).
+    # `parent` is the key of the containing entry, `state` the JSON-encoded
+    # attributes of the entry without its children.
+    #
+    # Series information, which all seasons of a series share, is stored
+    # once per series, identified by its TMDb id.
+    #
+    # Each update increments the catalog's generation (SQLite's
+    # `user_version`), so that other processes reading the catalog notice
+    # changes. Refreshes requested by such processes are queued as jobs,
+    # which have a JSON-encoded status once the indexer process runs them.
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                source TEXT, key TEXT, parent TEXT, type TEXT,
+                tmdb_id INTEGER, date TEXT, state TEXT,
+                PRIMARY KEY (source, key));
+            CREATE INDEX IF NOT EXISTS entries_tmdb_id ON entries (tmdb_id);
+            CREATE INDEX IF NOT EXISTS entries_type ON entries (type);
+            CREATE INDEX IF NOT EXISTS entries_date ON entries (date);
+            CREATE TABLE IF NOT EXISTS genres (
+                source TEXT, key TEXT, genre TEXT);
+            CREATE INDEX IF NOT EXISTS genres_entry ON genres (source, key);
+            CREATE INDEX IF NOT EXISTS genres_genre ON genres (genre);
+            CREATE TABLE IF NOT EXISTS series (
+                tmdb_id INTEGER PRIMARY KEY, info TEXT);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT,
+                status TEXT, done INTEGER DEFAULT 0);
+        ''')
+
+    def load(self, source):
+        # get rows (key, parent, type, date, state) of a source, ordered by
+        # date
+        with self.lock:
+            return self.db.execute(
+                'SELECT key, parent, type, date, state FROM entries '
+                'WHERE source = ? ORDER BY date, rowid', (source,)).fetchall()
+
+    def load_series(self, source):
+        # get JSON-encoded series information by TMDb id, for the seasons of
+        # a source
+        with self.lock:
+            return dict(self.db.execute(
+                'SELECT tmdb_id, info FROM series WHERE tmdb_id IN '
+                "(SELECT tmdb_id FROM entries WHERE source = ? "
+                "AND type = 'Season')", (source,)).fetchall())
+
+    def update(self, source, rows, removed, series={}):
+        # Insert or update `rows` (key, parent, type, tmdb_id, date, genres,
+        # state) and JSON-encoded `series` information by TMDb id, and delete
+        # the rows with keys in `removed`, in a single transaction.
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                for key in removed:
+                    self.db.execute('DELETE FROM entries '
+                                    'WHERE source = ? AND key = ?',
+                                    (source, key))
+                    self.db.execute('DELETE FROM genres '
+                                    'WHERE source = ? AND key = ?',
+                                    (source, key))
+                for key, parent, type, tmdb_id, date, genres, state in rows:
+                    self.db.execute(
+                        'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT (source, key) DO UPDATE SET '
+                        'parent = excluded.parent, type = excluded.type, '
+                        'tmdb_id = excluded.tmdb_id, date = excluded.date, '
+                        'state = excluded.state',
+                        (source, key, parent, type, tmdb_id, date, state))
+                    self.db.execute('DELETE FROM genres '
+                                    'WHERE source = ? AND key = ?',
+                                    (source, key))
+                    self.db.executemany('INSERT INTO genres VALUES (?, ?, ?)',
+                                        [(source, key, genre)
+                                         for genre in genres])
+                self.db.executemany('INSERT OR REPLACE INTO series '
+                                    'VALUES (?, ?)', series.items())
+                generation = self.db.execute(
+                    'PRAGMA user_version').fetchone()[0]
+                self.db.execute(f'PRAGMA user_version = {generation + 1}')
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def generation(self):
+        # number of updates so far
+        with self.lock:
+            return self.db.execute('PRAGMA user_version').fetchone()[0]
+
+    def submit_job(self, path, keep=100):
+        # queue a refresh of the entry at URL `path`, unless one is queued or
+        # running already; return the job's id
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute(
+                    'SELECT id FROM jobs WHERE path = ? AND done = 0',
+                    (path,)).fetchone()
+                if row is not None:
+                    id = row[0]
+                else:
+                    id = self.db.execute(
+                        'INSERT INTO jobs (path) VALUES (?)',
+                        (path,)).lastrowid
+                    # forget the oldest finished jobs
+                    self.db.execute('DELETE FROM jobs '
+                                    'WHERE id <= ? AND done = 1',
+                                    (id - keep,))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            return id
+
+    def queued_jobs(self):
+        # get (id, path) of the jobs that have not been started
+        with self.lock:
+            return self.db.execute('SELECT id, path FROM jobs '
+                                   'WHERE status IS NULL ORDER BY id'
+                                   ).fetchall()
+
+    def set_job_status(self, id, status):
+        with self.lock:
+            self.db.execute('UPDATE jobs SET status = ?, done = ? '
+                            'WHERE id = ?',
+                            (json.dumps(status), int(status['done']), id))
+
+    def job(self, id):
+        # get (path, status) of a job, status None if not started, or None
+        with self.lock:
+            row = self.db.execute('SELECT path, status FROM jobs '
+                                  'WHERE id = ?', (id,)).fetchone()
+        if row is None:
+            return None
+        path, status = row
+        return path, (json.loads(status) if status is not None else None)
+
+
+catalog = Catalog(os.path.join(cfg.dir, 'catalog.db'))
@@ -1,3 +1,5 @@
+import json
+import logging
 import os
 from yaml import safe_load
 
@@ -11,6 +13,59 @@ dir = os.path.join(
         ),
     'idaho')
 
+# defaults for optional settings
+scan_workers = 8
+tmdb_cache_ttl = {'search': 30, 'movie': 90, 'tv': 7}
+tmdb_cache_size = 100
+tmdb_offline = False
+tmdb_rate_limit = 40
+tmdb_base_url = 'https://api.themoviedb.org/3'
+tmdb_image_url = 'https://image.tmdb.org/t/p'
+save_delay = 2
+revalidate_in_background = True
+source_timeout = 30
+watch = False
+watch_delay = 5
+watch_interval = 60
+searches = {}
+everything = 'everything'
+poster_cache_size = 200
+page_size = 100
+log_level = 'info'
+log_format = 'text'
+separate_indexer = False
+
 # load configuration file and add contents to module
 with open(os.path.join(dir, 'config.yaml'), 'r') as f:
     globals().update(safe_load(f))
+
+
+class JSONFormatter(logging.Formatter):
+    # one JSON object per record, with time, level, logger and message, and
+    # the fields passed as `extra`, e.g. source and seconds
+
+    # attributes of every record, which are not extra fields
+    standard = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        data = {'time': self.formatTime(record), 'level': record.levelname,
+                'logger': record.name, 'message': record.getMessage()}
+        data.update((key, value) for key, value in vars(record).items()
+                    if key not in self.standard)
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+# log messages with level, by module; `log_level` is a level, or levels by
+# logger name ('' for all)
+if log_format == 'json':
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter())
+    logging.basicConfig(handlers=[handler])
+else:
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+for name, level in (log_level if isinstance(log_level, dict)
+                    else {'': log_level}).items():
+    logging.getLogger(name).setLevel(level.upper())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Export the pages of all entries in the catalog as static HTML files, for
+# browsing without a server process. Pages are written to
+# `<folder>/<URL path>/index.html`, and on later exports only pages that
+# changed since are written again, see `page_key`.
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import cfg
+# load entries from the catalog, without scanning
+cfg.separate_indexer = True
+import app
+from media import Collection, Entries, Search, Everything, walk
+
+log = logging.getLogger(__name__)
+
+package = os.path.dirname(os.path.abspath(__file__))
+
+# types of entries that are rendered as collections, see `app.show_path`
+collection_types = ['Collection', 'Source', 'Search', 'Everything']
+
+# entries by URL path of their pages, set before worker processes are
+# started, which inherit it
+pages = dict()
+# folder to export to
+folder = None
+# posters used in templates, as (URL, size), see `record_poster`
+posters_used = set()
+
+
+def collect_pages(sources):
+    # get entries by URL path of their pages, as served by `app.show_path`
+    pages = {'/': sources}
+    for name, entry in sources.entries.items():
+        if isinstance(entry, (Search, Everything)):
+            # their entries are those of the sources
+            pages[f'/{name}/'] = entry
+            continue
+        for key, _, item in walk(entry):
+            pages[f'/{name}/{key}/' if key else f'/{name}/'] = item
+    return pages
+
+
+def entry_data(entry):
+    # data of an entry that is shown on its page or its tile
+    data = dict(entry.state(), type=entry.type(),
+                info=getattr(entry, 'info', None))
+    if isinstance(entry, Collection):
+        data['facets'] = entry.facets
+    return data
+
+
+def page_key(entry):
+    # digest of the data shown on the page of an entry, including the tiles
+    # of its entries
+    if entry is app.sources:
+        data = [[name, entry_data(entry[name])] for name in entry]
+    elif isinstance(entry, Entries):
+        if entry.type() in collection_types:
+            names, _ = entry.page(size=len(entry.entries))
+        else:
+            names = list(entry)
+        data = [[name, entry_data(entry[name])] for name in names]
+        data.append(entry_data(entry))
+    else:
+        data = entry_data(entry)
+    return digest(json.dumps(data, sort_keys=True, default=str).encode())
+
+
+def renderer_key():
+    # digest of templates and static files, on which all pages depend
+    hash = hashlib.sha256()
+    for dir in ['templates', 'static']:
+        for name in sorted(os.listdir(os.path.join(package, dir))):
+            with open(os.path.join(package, dir, name), 'rb') as f:
+                hash.update(name.encode() + f.read())
+    return hash.hexdigest()
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def record_poster(url, size):
+    # `app.poster_url`, recording which posters have to be exported
+    if url is not None:
+        posters_used.add((url, size))
+    return app.poster_url(url, size)
+
+
+def render(url):
+    # render page at URL path to its file, in a worker process; return the
+    # posters used since the last call
+    entry = pages[url]
+    with app.app.test_request_context(url):
+        if entry is app.sources:
+            html = app.render_template('sources.html', sources=entry,
+                                       exported=True)
+        elif entry.type() in collection_types:
+            names, _ = entry.page(size=len(entry.entries))
+            html = app.render_template('collection.html', collection=entry,
+                                       names=names, next='', exported=True)
+        else:
+            type = entry.type().lower()
+            html = app.render_template(f'{type}.html', exported=True,
+                                       **{type: entry})
+    filename = page_file(url)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        f.write(html)
+    used = set(posters_used)
+    posters_used.clear()
+    return used
+
+
+def page_file(url):
+    return os.path.join(folder, url.lstrip('/'), 'index.html')
+
+
+def export_posters(used):
+    # Copy local copies of posters to the URL paths of `app.poster_url`,
+    # downloading those that are not in the poster store. Return those that
+    # cannot be downloaded, so that they are tried again by the next export.
+    missing = []
+    for url, size in used:
+        filename = os.path.join(folder, 'poster', size, url.lstrip('/'))
+        if os.path.exists(filename):
+            continue
+        hash = app.posters.store.get(url, size)
+        if hash is None:
+            missing.append([url, size])
+            continue
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        shutil.copyfile(app.posters.store.filename(hash), filename)
+    if len(missing) > 0:
+        log.warning('%d posters are not available and missing from the '
+                    'export', len(missing))
+    return missing
+
+
+def export(processes):
+    manifest_file = os.path.join(folder, 'manifest.json')
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {'renderer': None, 'pages': {}}
+    app.sources.join()
+    pages.update(collect_pages(app.sources))
+    # determine pages to render
+    renderer = renderer_key()
+    keys = {url: page_key(entry) for url, entry in pages.items()}
+    changed = [url for url, key in keys.items()
+               if renderer != manifest['renderer']
+               or manifest['pages'].get(url) != key
+               or not os.path.exists(page_file(url))]
+    removed = [url for url in manifest['pages'] if url not in keys]
+    log.info('exporting %d changed of %d pages, removing %d',
+             len(changed), len(keys), len(removed))
+    # Render in worker processes, which inherit the entries. Besides this one
+    # only the idle poster prefetch thread is running, so that workers don't
+    # inherit locks held by other threads, and workers use neither the
+    # catalog nor the poster store.
+    shutil.copytree(os.path.join(package, 'static'),
+                    os.path.join(folder, 'static'), dirs_exist_ok=True)
+    used = {tuple(poster) for poster in manifest.get('missing_posters', [])}
+    with ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('fork')) as pool:
+        for posters in pool.map(render, changed, chunksize=16):
+            used |= posters
+    missing = export_posters(used)
+    # remove pages of entries that no longer exist
+    for url in removed:
+        try:
+            os.remove(page_file(url))
+            os.removedirs(os.path.dirname(page_file(url)))
+        except OSError:
+            # folder not empty
+            pass
+    # write manifest last, so that an interrupted export is repeated
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump({'renderer': renderer, 'pages': keys,
+                   'missing_posters': missing}, f)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    log.info('exported to %s', folder)
+
+
+def main():
+    global folder
+    parser = argparse.ArgumentParser(
+        description='Export pages as static HTML files, e.g. to be served '
+        'by nginx.')
+    parser.add_argument('folder', help='folder to export to')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of worker processes, by default the '
+                        'number of CPUs')
+    args = parser.parse_args()
+    folder = os.path.abspath(args.folder)
+    app.app.jinja_env.globals['poster'] = record_poster
+    export(args.processes)
+
+
+if __name__ == '__main__':
+    main()
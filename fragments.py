@@ -0,0 +1,36 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    # cache of rendered HTML or other text, by a key that identifies the
+    # version of the rendered data, keeping the `size` most recently used
+    # fragments
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.fragments = OrderedDict()
+
+    def get(self, key, render):
+        # get fragment for `key`, or render it by calling `render`
+        with self.lock:
+            if key in self.fragments:
+                self.fragments.move_to_end(key)
+                return self.fragments[key]
+        fragment = render()
+        with self.lock:
+            self.fragments[key] = fragment
+            while len(self.fragments) > self.size:
+                self.fragments.popitem(last=False)
+        return fragment
+
+
+# rendered tiles, by name, path, type and version of the entry
+tiles = FragmentCache(20000)
+
+# rendered pages, by URL and version
+pages = FragmentCache(100)
+
+# subtitles converted to WebVTT, by filename, modification time and size
+subtitles = FragmentCache(100)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Scan sources and keep the catalog up to date, for web server processes
+# with `separate_indexer: true`, and run the refreshes they queue.
+
+import logging
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import cfg
+import jobs
+from catalog import catalog
+from media import Sources, Search
+from watcher import Watcher
+
+log = logging.getLogger(__name__)
+
+# seconds between checks for queued refreshes
+poll_interval = 0.25
+
+
+def resolve(sources, path):
+    # get entry from the URL path a refresh was requested for, as in
+    # `app.show_path` and `app.show_search`
+    url = urlsplit(path)
+    if url.path == '/search':
+        query = parse_qs(url.query).get('q', [''])[0]
+        return Search(query, f'search: {query}')
+    entry = sources
+    for part in url.path.strip('/').split('/'):
+        entry = entry[part]
+    return entry
+
+
+def refresh(sources, entry):
+    # refresh entry, and save it before the job is done so that web servers
+    # load the refreshed entry when it is
+    entry.refresh()
+    sources.save_all()
+
+
+def run_jobs(sources):
+    # start queued refreshes, and report the status of running ones when it
+    # changes
+    running = dict()
+    while True:
+        for id, path in catalog.queued_jobs():
+            try:
+                entry = resolve(sources, path)
+            except KeyError:
+                log.warning('cannot refresh %s, not found', path)
+                catalog.set_job_status(id, {'probed': 0, 'updated': 0,
+                                            'errors': 1, 'done': True})
+                continue
+            running[id] = (jobs.runner.submit(
+                path, lambda entry=entry: refresh(sources, entry)), None)
+        for id, (job, last) in list(running.items()):
+            status = job.status()
+            del status['id'], status['path']
+            if status != last:
+                catalog.set_job_status(id, status)
+                running[id] = (job, status)
+            if status['done']:
+                del running[id]
+        time.sleep(poll_interval)
+
+
+def main():
+    sources = Sources.get()
+    if cfg.watch:
+        Watcher(sources).start()
+    run_jobs(sources)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import contextvars
+import itertools
+import logging
+import threading
+import time
+
+from catalog import catalog
+
+log = logging.getLogger(__name__)
+
+# job that is executed in the current context, see `count`
+current = contextvars.ContextVar('job', default=None)
+
+
+def count(name):
+    # count progress of the current job, if any
+    job = current.get()
+    if job is not None:
+        job.count(name)
+
+
+class Job:
+    # a function running in the background, e.g. the refresh of an entry,
+    # with counts of names probed, entries updated and errors
+
+    def __init__(self, id, path, function):
+        self.id = id
+        self.path = path
+        self.function = function
+        self.counts = {'probed': 0, 'updated': 0, 'errors': 0}
+        self.done = False
+        self.changed = threading.Condition()
+
+    def run(self):
+        current.set(self)
+        try:
+            self.function()
+        except Exception:
+            log.exception('job %d for %s failed', self.id, self.path)
+            self.count('errors')
+        finally:
+            with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+    def count(self, name):
+        with self.changed:
+            self.counts[name] += 1
+            self.changed.notify_all()
+
+    def status(self):
+        return dict(self.counts, id=self.id, path=self.path, done=self.done)
+
+    def watch(self, interval=0.25, timeout=15):
+        # Generate the status when it changes, at most every `interval`
+        # seconds, until the job is done. Without changes the status is
+        # repeated after `timeout` seconds, so that a client that went away
+        # is noticed.
+        last = None
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: self.status() != last, timeout)
+                status = self.status()
+            yield status
+            if status['done']:
+                return
+            last = status
+            time.sleep(interval)
+
+
+class JobRunner:
+    # jobs by id, with at most one running job per path
+
+    def __init__(self, keep=100):
+        # number of finished jobs to keep
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.jobs = dict()
+        self.running = dict()
+        self.ids = itertools.count(1)
+
+    def submit(self, path, function):
+        # run `function` in the background, unless a job for `path` is
+        # already running; return the job
+        with self.lock:
+            job = self.running.get(path)
+            if job is not None and not job.done:
+                return job
+            job = Job(next(self.ids), path, function)
+            self.jobs[job.id] = job
+            self.running[path] = job
+            # forget the oldest finished jobs
+            finished = [id for id, j in self.jobs.items() if j.done]
+            for id in finished[:max(0, len(finished) - self.keep)]:
+                del self.jobs[id]
+            self.running = {path: j for path, j in self.running.items()
+                            if not j.done}
+        threading.Thread(target=job.run, name=f'job {job.id}',
+                         daemon=True).start()
+        return job
+
+    def get(self, id):
+        return self.jobs.get(id)
+
+
+class QueuedJob:
+    # a job run by the indexer process, whose status is obtained from the
+    # catalog, see `QueuedRunner`
+
+    def __init__(self, id, path):
+        self.id = id
+        self.path = path
+
+    def status(self):
+        _, status = catalog.job(self.id)
+        if status is None:
+            # queued
+            status = {'probed': 0, 'updated': 0, 'errors': 0, 'done': False}
+        return dict(status, id=self.id, path=self.path)
+
+    def watch(self, interval=0.25, timeout=15):
+        # like `Job.watch`, but polling the catalog every `interval` seconds
+        last = None
+        last_time = 0
+        while True:
+            status = self.status()
+            if status != last or time.monotonic() - last_time >= timeout:
+                yield status
+                if status['done']:
+                    return
+                last = status
+                last_time = time.monotonic()
+            time.sleep(interval)
+
+
+class QueuedRunner:
+    # Runner of a web server process with a separate indexer process (see
+    # `cfg.separate_indexer` and `indexer.py`), which queues jobs in the
+    # catalog for the indexer to run. Jobs are identified by the path they
+    # were submitted for, `function` is not used.
+
+    def submit(self, path, function):
+        return QueuedJob(catalog.submit_job(path), path)
+
+    def get(self, id):
+        job = catalog.job(id)
+        if job is None:
+            return None
+        path, _ = job
+        return QueuedJob(id, path)
+
+
+runner = JobRunner()
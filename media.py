@@ -1,19 +1,43 @@
 #!/usr/bin/env python3
 
+import contextvars
+import hashlib
+import json
+import logging
 import os
 import re
 import subprocess
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import deepcopy
 from statistics import median
 
-from yaml import unsafe_load, dump, YAMLObject
+from yaml import unsafe_load, YAMLObject
 import tmdbsimple as tmdb
 
 import cfg
+import jobs
+import metrics
+import posters
+import sortedindex
+import tmdbclient
+from catalog import catalog
+from searchindex import index
+from snapshot import folder_fingerprint, snapshots
+
+log = logging.getLogger(__name__)
 
 # TMDb configuration
 tmdb.API_KEY = cfg.TMDb_API_key
 search = tmdb.Search()
 
+# subtitle formats that can be streamed, see `app.stream_subtitle`
+subtitle_extensions = ['.srt', '.vtt']
+
 # mapping to unify TMDb's movie and TV genres for filter
 genre_filter_map = {
     'Adventure':        'Action & Adventure',
@@ -25,27 +49,76 @@ genre_filter_map = {
 
 
 class Entry(YAMLObject):
+    # attributes that are not stored in the catalog
+    transient = ('entries', 'dirty', 'version')
+    # whether stored attributes changed since the entry was last saved
+    dirty = False
+    # time of the last change of any attribute, see `new_version`; entries
+    # loaded from the catalog have the time they were loaded
+    version = time.time()
+    # fingerprint of the entry's folder when it was last scanned, see
+    # `folder_fingerprint`; a class attribute so that it is not stored for
+    # entries that don't have folders to scan
+    fingerprint = None
+    # identity of the entry's main video file, see `Identities`
+    identity = None
+
+    def __setattr__(self, name, value):
+        # mark entry as dirty if a stored attribute changes, and update its
+        # version if any attribute changes
+        if (name not in ('dirty', 'version')) and (getattr(self, name, None)
+                                                   != value):
+            if name not in self.transient:
+                super().__setattr__('dirty', True)
+            super().__setattr__('version', new_version())
+        super().__setattr__(name, value)
+
+    def state(self):
+        # get attributes to be stored in the catalog
+        return {name: value for name, value in vars(self).items()
+                if name not in self.transient}
+
     def open(self):
         # open (containing) folder
         path = self.path
         if os.path.isfile(path):
             path = os.path.dirname(path)
-        print('opening', self)
+        log.info('opening %s', self)
         subprocess.Popen(['xdg-open', path])
 
     def refresh(self):
-        print('refreshing', self)
-        # invalidate info
-        if hasattr(self, 'info'):
-            self.info = None
-        # recreate info
-        self.add_info()
-        # save updated data
-        Sources.get().save_all()
+        log.info('refreshing %s', self)
+        # invalidate folder fingerprint
+        if self.fingerprint is not None:
+            self.fingerprint = None
+        if self.identity is not None:
+            self.identity = None
+        snapshots.invalidate(self.path)
+        # get info again; it is replaced only when that succeeds, so that
+        # the entry can be shown in the meantime and if it fails
+        try:
+            with series_memo.scope():
+                self.add_info(force=True)
+        except tmdbclient.Offline:
+            log.warning('offline, keeping previous info of %s', self)
+        finally:
+            # update collections containing the entry, and save updated data
+            Sources.get().entry_changed(self)
+            Sources.get().save_soon()
 
     def date(self):
         return '?'
 
+    def moved(self, path):
+        # copy of entry for its new path, keeping its information; only the
+        # series record of a season (see `SeriesRecords`) remains shared
+        info = getattr(self, 'info', None)
+        series = None if info is None else info.get('series')
+        memo = {} if series is None else {id(series): series}
+        entry = deepcopy(self, memo)
+        entry.path = path
+        return entry
+
     def type(self):
         return self.__class__.__name__
 
@@ -53,6 +126,20 @@ class Entry(YAMLObject):
         return f'Entry(path="{self.path}")'
 
 
+version_lock = threading.Lock()
+last_version = Entry.version
+
+
+def new_version():
+    # get a strictly increasing time stamp, so that the versions of entries
+    # identify their states, and the latest of several versions identifies
+    # the state of all of them
+    global last_version
+    with version_lock:
+        last_version = max(time.time(), last_version + 1e-6)
+        return last_version
+
+
 class Entries:
     def __iter__(self):
         return iter(self.entries.keys())
@@ -67,7 +154,7 @@ class Unknown(Entry):
     def __init__(self, path):
         self.path = path
 
-    def add_info(self):
+    def add_info(self, force=False):
         pass
 
     def filter_genres(self):
@@ -85,42 +172,50 @@ class Movie(Entry):
         self.path = path
         self.info = None
 
-    def add_info(self):
-        # create uid and use it to check whether `info` is up-to-date
+    def add_info(self, force=False):
+        # create uid and use it to check whether `info` is up-to-date, unless
+        # it is to be obtained again
         uid = f'M{self.tmdb_id}'
-        if (self.info is not None) and (self.info['uid'] == uid):
+        if (not force and self.info is not None
+                and self.info['uid'] == uid):
             return
         # if not, get information from TMDb
+        # details, credits and external ids in a single request; the latter
+        # two are not set as attributes because `movie` has methods of the
+        # same names
         movie = tmdb.Movies(self.tmdb_id)
-        movie.info()
-        movie.credits()
+        response = movie.info(append_to_response='credits,external_ids')
+        credits = response['credits']
         # augmented genres
         genres = [genre['name'] for genre in movie.genres]
         if movie.adult:
             genres.append('Adult')
         # add `info`
-        self.info = {
+        self.info = compact({
             'uid':          uid,
             'date':         movie.release_date,
             'title':        movie.original_title,
             'title_en':     (movie.title if movie.title != movie.original_title
                              else None),
             'year':         movie.release_date[:4],
-            'directors':    ', '.join(person['name'] for person in movie.crew
+            'directors':    ', '.join(person['name']
+                                      for person in credits['crew']
                                       if person['job'] == 'Director'),
-            'writers':      ', '.join(person['name'] for person in movie.crew
+            'writers':      ', '.join(person['name']
+                                      for person in credits['crew']
                                       if person['job']
                                       in ['Writer', 'Screenplay', 'Author']),
-            'actors':       ', '.join(person['name'] for person in movie.cast
+            'actors':       ', '.join(person['name']
+                                      for person in credits['cast']
                                       if person['order'] < 3),
             'genres':       genres,
             'runtime':      movie.runtime,
             'countries':    '/'.join(country['iso_3166_1'] for country
                                      in movie.production_countries),
             'poster_url':   movie.poster_path,
-            'imdb_id':      movie.external_ids()['imdb_id'],
+            'imdb_id':      response['external_ids']['imdb_id'],
             'vote_average': movie.vote_average
-        }
+        })
 
     def date(self):
         return self.info['date']
@@ -129,30 +224,50 @@ class Movie(Entry):
         return {genre_filter_map.get(genre, genre)
                 for genre in self.info['genres']}
 
+    def video(self, _=None):
+        # get path of the video file: the path itself for a file, the
+        # largest file for a folder; None if there is none
+        try:
+            folder = snapshots.get(self.path)
+        except NotADirectoryError:
+            return self.path
+        except FileNotFoundError:
+            return None
+        filename = None
+        size = 0
+        for n in folder.files:
+            s = folder.size(n)
+            log.debug('file %s, size %d', n, s)
+            if s > size:
+                size = s
+                filename = os.path.join(self.path, n)
+        return filename
+
+    def subtitles(self, _=None):
+        # get paths of subtitle files: those of a file, see
+        # `sidecar_subtitles`, or those in a folder and its subfolders
+        try:
+            folder = snapshots.get(self.path)
+        except NotADirectoryError:
+            return sidecar_subtitles(self.path)
+        except FileNotFoundError:
+            return []
+        return subtitle_files(self.path) + [
+            filename for sub in sorted(folder.dirs)
+            for filename in subtitle_files(os.path.join(self.path, sub))]
+
     def play(self, _):
-        if os.path.isfile(self.path):
-            mpv_play(self.path)
+        filename = self.video()
+        if filename is None:
             return
-        if os.path.isdir(self.path):
-            # folder path
-            # look for largest file, and collect subfolders
-            filename = None
-            subs = []
-            size = 0
-            for n in os.listdir(self.path):
-                fn = os.path.join(self.path, n)
-                if os.path.isfile(fn):
-                    s = os.path.getsize(fn)
-                    print('FILE', s, '\t', fn)
-                    if s > size:
-                        size = s
-                        filename = fn
-                if os.path.isdir(fn):
-                    print('DIR', fn)
-                    subs.append(n)
-            if filename is not None:
-                mpv_play(filename, sub_auto_all=True, subs=subs)
-                return
+        if filename == self.path:
+            # file path
+            mpv_play(filename)
+            return
+        # folder path, subtitles may be in subfolders
+        subs = sorted(snapshots.get(self.path).dirs)
+        log.debug('subtitle folders %s', subs)
+        mpv_play(filename, sub_auto_all=True, subs=subs)
 
     def __repr__(self):
         return f'Movie(tmdb_id={self.tmdb_id}, path="{self.path}")'
@@ -168,15 +283,21 @@ class Season(Entry):
         self.info = None
         self.episodes = []
 
-    def add_info(self):
-        # scan for episodes
-        self.episodes = scan_episodes(self.path, self.season_number)
+    def add_info(self, force=False):
+        # scan for episodes, unless the folder is unchanged
+        fingerprint = folder_fingerprint(self.path)
+        if fingerprint != self.fingerprint:
+            folder = snapshots.get(self.path, fingerprint)
+            self.episodes = scan_episodes(folder, self.season_number)
+            self.fingerprint = folder.fingerprint
         # create uid and use it to check whether `info` is up-to-date
         uid = f'S{self.tmdb_id}s{self.season_number}'
-        if (self.info is not None) and (self.info['uid'] == uid):
+        if (not force and self.info is not None
+                and self.info['uid'] == uid):
             return
         # if not, get information from TMDb
         series, seasons = get_series_info(self.tmdb_id)
+        series = series_records.share(self.tmdb_id, series)
         season = None
         for s in seasons:
             if s['season_number'] == self.season_number:
@@ -196,7 +317,7 @@ class Season(Entry):
             date = '-'.join(dp)
             year = date[:4] + ' ?'
         # add `info`
-        self.info = {
+        self.info = compact({
             'uid':        uid,
             'date':       date,
             'name':       (season['name'] if season is not None
@@ -204,7 +325,16 @@ class Season(Entry):
             'poster_url': poster_url,
             'year':       year,
             'series':     series
-        }
+        })
+
+    def state(self):
+        # the series information is stored once for all seasons of a series,
+        # see `SeriesRecords`
+        state = super().state()
+        if self.info is not None:
+            state['info'] = {key: value for key, value in self.info.items()
+                             if key != 'series'}
+        return state
 
     def date(self):
         return self.info['date']
@@ -213,17 +343,18 @@ class Season(Entry):
         return {genre_filter_map.get(genre, genre)
                 for genre in self.info['series']['genres']}
 
-    def play(self, episode_index):
+    def video(self, episode_index):
         episode_index = int(episode_index)
-        filename = os.path.join(self.path, self.episodes[episode_index][1])
-        mpv_play(filename)
-        return
+        # negative indices would count from the end
+        if episode_index < 0:
+            raise IndexError(episode_index)
+        return os.path.join(self.path, self.episodes[episode_index][1])
 
-    def __getstate__(self):
-        # prevent `episodes` from being stored
-        state = self.__dict__.copy()
-        del state['episodes']
-        return state
+    def subtitles(self, episode_index):
+        return sidecar_subtitles(self.video(episode_index))
+
+    def play(self, episode_index):
+        mpv_play(self.video(episode_index))
 
     def __repr__(self):
         return (f'Season(tmdb_id={self.tmdb_id}, '
@@ -233,9 +364,144 @@ class Season(Entry):
 
 def get_series_info(tmdb_id):
     # used by `Series.add_info()` and `Season.add_info()`
+    return series_memo.get(tmdb_id)
+
+
+class SeriesMemo:
+    # Memo for series information, so that within a scan each series is
+    # fetched only once, however many `Season`s and `Series` refer to it.
+    # Each scan, i.e. outermost `scope`, has a memo of its own, which is
+    # shared by the threads working for it through their context; concurrent
+    # scans, e.g. a refresh during a revalidation, don't share theirs.
+
+    def __init__(self):
+        # memo of the current scan
+        self.memo = contextvars.ContextVar('series_memo', default=None)
+
+    @contextmanager
+    def scope(self):
+        # the outermost scope starts with an empty memo and reports counters
+        if self.memo.get() is not None:
+            yield
+            return
+        memo = ScanMemo()
+        token = self.memo.set(memo)
+        try:
+            yield
+        finally:
+            self.memo.reset(token)
+            log.info('series info: %d fetched, %d reused',
+                     memo.misses, memo.hits)
+
+    def get(self, tmdb_id):
+        memo = self.memo.get()
+        if memo is None:
+            return fetch_series_info(tmdb_id)
+        with memo.lock:
+            future = memo.results.get(tmdb_id)
+            # the first thread asking fetches, concurrent ones wait for it
+            first = future is None
+            if first:
+                future = Future()
+                memo.results[tmdb_id] = future
+                memo.misses += 1
+            else:
+                memo.hits += 1
+        if first:
+            try:
+                future.set_result(fetch_series_info(tmdb_id))
+            except Exception as e:
+                # threads waiting get the error, later ones fetch again
+                with memo.lock:
+                    del memo.results[tmdb_id]
+                future.set_exception(e)
+        info, seasons = future.result()
+        # callers modify and store their copy of `info`
+        return deepcopy(info), seasons
+
+
+class ScanMemo:
+    # series information of a scan, see `SeriesMemo`
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # futures of (info, seasons) by TMDb id
+        self.results = dict()
+        self.hits = 0
+        self.misses = 0
+
+
+series_memo = SeriesMemo()
+
+
+class SeriesRecords:
+    # Series information by TMDb id, a single record that all `Season`s of a
+    # series refer to instead of each holding a copy. In the catalog, too,
+    # each record is stored once, see `Source.save`.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = dict()
+
+    def share(self, tmdb_id, info):
+        # get the record equal to `info`, which replaces an outdated one
+        info = compact(info)
+        with self.lock:
+            record = self.records.get(tmdb_id)
+            if record != info:
+                record = info
+                self.records[tmdb_id] = record
+        return record
+
+    def get(self, tmdb_id):
+        with self.lock:
+            return self.records.get(tmdb_id)
+
+
+series_records = SeriesRecords()
+
+
+def compact(info):
+    # Get a copy of `info` in which keys and values that many entries have in
+    # common are shared objects: keys (which are not interned when loaded
+    # from JSON) and countries and years are interned strings, and genres a
+    # tuple of interned strings.
+    info = {sys.intern(key): value for key, value in info.items()}
+    if 'genres' in info:
+        info['genres'] = tuple(sys.intern(genre) for genre in info['genres'])
+    for key in ('countries', 'year', 'years'):
+        if isinstance(info.get(key), str):
+            info[key] = sys.intern(info[key])
+    return info
+
+
+def placeholder_series(season):
+    # series record for a season whose series information is missing, from
+    # the season's own information and folder, until it is obtained again
+    info = season.info
+    return compact({
+        'date':              info['date'],
+        'name':              os.path.basename(season.path),
+        'name_en':           None,
+        'years':             info['year'],
+        'number_of_seasons': '?',
+        'creators':          '',
+        'actors':            '',
+        'genres':            [],
+        'countries':         '',
+        'runtime':           '?',
+        'poster_url':        info['poster_url'],
+        'imdb_id':           None,
+        'vote_average':      '?'
+    })
+
+
+def fetch_series_info(tmdb_id):
+    # details, credits and external ids in a single request, see
+    # `Movie.add_info`
     series = tmdb.TV(tmdb_id)
-    series.info()
-    series.credits()
+    response = series.info(append_to_response='credits,external_ids')
+    credits = response['credits']
 
     first_year = series.first_air_date[:4]
     last_year = series.last_air_date[:4]
@@ -254,7 +520,8 @@ def get_series_info(tmdb_id):
         'number_of_seasons': series.number_of_seasons,
         'creators':          ', '.join(person['name']
                                        for person in series.created_by),
-        'actors':            ', '.join(person['name'] for person in series.cast
+        'actors':            ', '.join(person['name']
+                                       for person in credits['cast']
                                        if person['order'] < 3),
         'genres':            [genre['name'] for genre in series.genres],
         'countries':         '/'.join(country['iso_3166_1'] for country
@@ -262,10 +529,10 @@ def get_series_info(tmdb_id):
         'runtime':           (median(series.episode_run_time)
                               if len(series.episode_run_time) > 0 else '?'),
         'poster_url':        series.poster_path,
-        'imdb_id':           series.external_ids()['imdb_id'],
+        'imdb_id':           response['external_ids']['imdb_id'],
         'vote_average':      series.vote_average
     }
-    return info, series.seasons
+    return compact(info), series.seasons
 
 
 class Series(Entry, Entries):
@@ -278,7 +545,30 @@ class Series(Entry, Entries):
         self.entries = dict()
         self.episodes = []
 
-    def add_info(self):
+    def add_info(self, force=False):
+        # names skipped because of errors or offline mode
+        skipped = []
+        fingerprint = folder_fingerprint(self.path)
+        if fingerprint == self.fingerprint:
+            # folder unchanged, only update seasons and movies
+            self.entries = update_entries(self.entries, skipped)
+        else:
+            folder = snapshots.get(self.path, fingerprint)
+            self.scan(folder, skipped)
+            fingerprint = folder.fingerprint
+        # if names were skipped, scan again next time
+        self.fingerprint = fingerprint if len(skipped) == 0 else None
+        # create uid and use it to check whether `info` is up-to-date
+        uid = f'S{self.tmdb_id}'
+        if (not force and self.info is not None
+                and self.info['uid'] == uid):
+            return
+        # if not, get information from TMDb
+        info, _ = get_series_info(self.tmdb_id)
+        info['uid'] = uid
+        self.info = info
+
+    def scan(self, folder, skipped):
         # separate entries into seasons and movies
         seasons = {name: entry for name, entry in self.entries.items()
                    if isinstance(entry, Season)}
@@ -286,16 +576,16 @@ class Series(Entry, Entries):
                   if isinstance(entry, Movie)}
         # scan for seasons
         seasons = scan_folder(
-            self.path, seasons,
+            folder, seasons,
             [lambda name, path:
                 probe_processed_folder_season(name, path, self.tmdb_id)],
-            [])
+            [], skipped)
         if len(seasons) > 0:
             # if there are seasons, scan for movies
             movies = scan_folder(
-                self.path, movies,
+                folder, movies,
                 [],
-                [probe_processed_file_movie])
+                [probe_processed_file_movie], skipped)
             # put seasons and movies together as entries, sorted
             entries = seasons
             entries.update(movies)
@@ -306,16 +596,9 @@ class Series(Entry, Entries):
             self.episodes = []
         else:
             # if there are no seasons (Miniseries), scan for episodes
-            self.episodes = scan_episodes(self.path, 1)
+            self.episodes = scan_episodes(folder, 1)
             # no seasons and movies
             self.entries = dict()
-        # create uid and use it to check whether `info` is up-to-date
-        uid = f'S{self.tmdb_id}'
-        if (self.info is not None) and (self.info['uid'] == uid):
-            return
-        # if not, get information from TMDb
-        self.info, _ = get_series_info(self.tmdb_id)
-        self.info['uid'] = uid
 
     def date(self):
         return self.info['date']
@@ -324,17 +607,18 @@ class Series(Entry, Entries):
         return {genre_filter_map.get(genre, genre)
                 for genre in self.info['genres']}
 
-    def play(self, episode_index):
+    def video(self, episode_index):
         episode_index = int(episode_index)
-        filename = os.path.join(self.path, self.episodes[episode_index][1])
-        mpv_play(filename)
-        return
+        # negative indices would count from the end
+        if episode_index < 0:
+            raise IndexError(episode_index)
+        return os.path.join(self.path, self.episodes[episode_index][1])
 
-    def __getstate__(self):
-        # prevent `episodes` from being stored
-        state = self.__dict__.copy()
-        del state['episodes']
-        return state
+    def subtitles(self, episode_index):
+        return sidecar_subtitles(self.video(episode_index))
+
+    def play(self, episode_index):
+        mpv_play(self.video(episode_index))
 
     def __repr__(self):
         return (f'Series(tmdb_id={self.tmdb_id}, path="{self.path}")')
@@ -343,99 +627,623 @@ class Series(Entry, Entries):
 class Collection(Entry, Entries):
     yaml_tag = '!Collection'
 
+    transient = Entry.transient + ('facets',)
+    # aggregated genres and media types with counts, and range of dates, of
+    # the entries within the collection; see `update_facets`
+    facets = {'genres': {}, 'types': {}, 'dates': None}
+
     def __init__(self, path, title):
         self.path = path
         self.title = title
         self.entries = dict()
 
-    def add_info(self):
-        # scan folder for entries
-        folder_probes = [probe_torrent_folder_season,
-                         probe_torrent_folder_movie,
-                         probe_processed_folder_series,
-                         probe_processed_folder_collection]
-        file_probes = [probe_processed_file_movie]
-        self.entries = scan_folder(self.path, self.entries,
-                                   folder_probes, file_probes)
+    def add_info(self, force=False):
+        # names skipped because of errors or offline mode
+        skipped = []
+        fingerprint = folder_fingerprint(self.path)
+        if fingerprint == self.fingerprint:
+            # folder unchanged, only update entries
+            self.entries = update_entries(self.entries, skipped)
+        else:
+            # scan folder for entries
+            folder_probes = [probe_torrent_folder_season,
+                             probe_torrent_folder_movie,
+                             probe_processed_folder_series,
+                             probe_processed_folder_collection]
+            file_probes = [probe_processed_file_movie]
+            folder = snapshots.get(self.path, fingerprint)
+            self.entries = scan_folder(folder, self.entries,
+                                       folder_probes, file_probes, skipped)
+            fingerprint = folder.fingerprint
+        # if names were skipped, scan again next time
+        self.fingerprint = fingerprint if len(skipped) == 0 else None
+        self.update_facets()
+
+    def update_facets(self):
+        # aggregate facets of entries, using those of contained collections
+        genres = dict()
+        types = dict()
+        dates = []
+        for entry in self.entries.values():
+            if isinstance(entry, Collection):
+                facets = entry.facets
+                types['Collection'] = types.get('Collection', 0) + 1
+                if facets['dates'] is not None:
+                    dates.extend(facets['dates'])
+            else:
+                facets = {'genres': dict.fromkeys(entry.filter_genres(), 1),
+                          'types': {entry.type(): 1}}
+                if entry.date() != '?':
+                    dates.append(entry.date())
+            for genre, count in facets['genres'].items():
+                genres[genre] = genres.get(genre, 0) + count
+            for type, count in facets['types'].items():
+                types[type] = types.get(type, 0) + count
+        self.facets = {'genres': dict(sorted(genres.items())),
+                       'types': types,
+                       'dates': [min(dates), max(dates)] if dates else None}
 
     def date(self):
-        if len(self.entries) > 0:
-            # date from first entry
-            return list(self.entries.values())[0].info['date']
+        # date of earliest entry
+        if self.facets['dates'] is not None:
+            return self.facets['dates'][0]
         else:
             return '?'
 
     def filter_genres(self):
-        fg = set()
-        for entry in self.entries.values():
-            fg.update(entry.filter_genres())
-        return sorted(fg)
+        return list(self.facets['genres'])
+
+    def page(self, cursor=None, sort='date', genre=None, type=None,
+             size=100):
+        # Get names of up to `size` entries following `cursor`, and the
+        # cursor of the next page (`None` for the last page). Entries are
+        # ordered by `sort`, 'date' or 'name', descending with prefix '-',
+        # and filtered by genre and media type ('movie', 'series' or
+        # 'collection'). A cursor is the (key, name) of the last entry of a
+        # page, so paging is not disturbed by entries added or removed in
+        # between.
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        if sort not in sort_keys:
+            raise ValueError(f'unknown sort "{sort}"')
+        if type is not None and type not in media_types:
+            raise ValueError(f'unknown media type "{type}"')
+        items = [(sort_keys[sort](name, entry), name)
+                 for name, entry in self.entries.items()
+                 if (genre is None or genre in entry.filter_genres())
+                 and (type is None or entry.type() in media_types[type])]
+        # entries are kept in order of date (see `update_entries`), so that
+        # they usually don't need sorting by date
+        if sort != 'date' or any(b < a for a, b in zip(items, items[1:])):
+            items.sort()
+        if descending:
+            end = (len(items) if cursor is None
+                   else bisect_left(items, tuple(cursor)))
+            items = items[:end][::-1]
+        else:
+            start = 0 if cursor is None else bisect_right(items, tuple(cursor))
+            items = items[start:]
+        names = [name for _, name in items[:size]]
+        next = list(items[size - 1]) if len(items) > size else None
+        return names, next
 
     def __repr__(self):
         return f'Collection(path="{self.path}", title="{self.title}")'
 
 
+class Search(Collection):
+    # virtual collection of the entries of all sources that match a query,
+    # see `searchindex`
+
+    def __init__(self, query, title):
+        self.query = query
+        self.title = title
+        self.path = ''
+        self.evaluate()
+
+    def evaluate(self):
+        # determine entries, keyed by URL path, and their facets
+        self.entries = dict(sorted(index.search(self.query),
+                                   key=lambda item: item[1].date()))
+        self.update_facets()
+
+    def add_info(self, force=False):
+        self.evaluate()
+
+    def refresh(self):
+        self.evaluate()
+
+    def open(self):
+        pass
+
+    def __repr__(self):
+        return f'Search(query="{self.query}")'
+
+
+class Everything(Collection):
+    # virtual collection of the movies, series and seasons of all sources,
+    # keyed by URL path, see `sortedindex`
+
+    transient = Collection.transient + ('generation',)
+
+    def __init__(self, title):
+        self.title = title
+        self.path = ''
+        self.entries = sortedindex.index.entries
+        self.evaluate()
+
+    def evaluate(self):
+        # take over facets, and if the index changed update the version
+        self.facets = sortedindex.index.facets()
+        self.generation = sortedindex.index.generation
+
+    def update_facets(self):
+        self.evaluate()
+
+    def add_info(self, force=False):
+        self.evaluate()
+
+    def refresh(self):
+        self.evaluate()
+
+    def page(self, cursor=None, sort='date', genre=None, type=None,
+             size=100):
+        # see `Collection.page`, but from the index instead of sorting
+        if sort.lstrip('-') not in sortedindex.sort_keys:
+            raise ValueError(f'unknown sort "{sort}"')
+        if type is not None and type not in media_types:
+            raise ValueError(f'unknown media type "{type}"')
+        return sortedindex.index.page(
+            cursor, sort, genre,
+            media_types[type] if type is not None else None, size)
+
+    def open(self):
+        pass
+
+    def __repr__(self):
+        return f'Everything(title="{self.title}")'
+
+
+# entry classes by type, for creating entries from the catalog
+entry_types = {cls.__name__: cls
+               for cls in [Unknown, Movie, Season, Series, Collection]}
+
+# sort keys of entries by name, for `Collection.page`
+sort_keys = {
+    'date': lambda name, entry: entry.date(),
+    'name': lambda name, entry: name.casefold(),
+}
+
+# entry types by media type, for `Collection.page`
+media_types = {
+    'movie':        ['Movie'],
+    'series':       ['Series', 'Season'],
+    'collection':   ['Collection', 'Source', 'Search', 'Everything'],
+}
+
+
 class Source(Collection):
-    # a `Source` is a `Collection` that is backed by a YAML-format cache
+    # a `Source` is a `Collection` that is backed by the catalog
+
+    # of the source itself, only the fingerprint and status are stored
+    transient = Collection.transient + ('path', 'title', 'saved',
+                                        'save_lock', 'loaded', 'late')
+    # 'ok' if the folder was scanned, 'stale' if it could not be and entries
+    # from the catalog are shown, 'offline' if there are none
+    status = 'ok'
+    # whether loading or revalidating takes longer than `cfg.source_timeout`,
+    # see `Sources.concurrently`
+    late = False
 
     def __init__(self, path, title):
         super().__init__(path, title)
-        print('initializing', self)
-        self.load()
+        # dates of the entries as last loaded or saved, by catalog key
+        self.saved = dict()
+        self.save_lock = threading.Lock()
+        # set when entries have been loaded, see `Sources.__init__`
+        self.loaded = threading.Event()
+
+    def revalidate(self):
+        # update entries from the file system and TMDb, and save changes
+        self.loaded.wait()
+        log.info('revalidating %s', self)
         self.add_info()
         self.save()
 
+    def add_info(self, force=False):
+        # scan folder, unless it is unavailable, e.g. a missing network mount
+        # or an empty mount point
+        try:
+            # an unmounted mount point differs from the mounted folder
+            fingerprint = folder_fingerprint(self.path)
+            if fingerprint != self.fingerprint:
+                folder = snapshots.get(self.path, fingerprint)
+                if len(folder.names) == 0 and len(self.entries) > 0:
+                    raise FileNotFoundError(f'"{self.path}" is empty, '
+                                            'not mounted?')
+            super().add_info(force)
+        except OSError as e:
+            self.unavailable(e)
+            return
+        self.status = 'ok'
+
+    def unavailable(self, reason):
+        # keep entries, marking them as stale
+        self.status = 'stale' if len(self.entries) > 0 else 'offline'
+        log.warning('%s is %s: %s', self, self.status, reason,
+                    extra={'source': self.title, 'status': self.status})
+
+    def shown_status(self):
+        # status, or the reason that entries are missing or may be outdated
+        if not self.loaded.is_set():
+            return 'loading'
+        if self.late and self.status == 'ok':
+            return 'stale'
+        return self.status
+
+    @metrics.catalog_seconds.time(operation='load')
     def load(self):
-        # determine name of entries file
+        # load entries from catalog
+        log.info('loading %s', self)
+        try:
+            self.load_entries()
+        finally:
+            self.loaded.set()
+
+    def load_entries(self):
+        rows = catalog.load(self.path)
+        if len(rows) == 0:
+            self.import_entries_file()
+            return
+        # Create entries. They are put into a new dict of entries of the
+        # source, which replaces the current one at once, so that it can be
+        # used by other threads while loading.
+        containers = {'': dict()}
+        entries = dict()
+        saved = dict()
+        series = catalog.load_series(self.path)
+        version = new_version()
+        for key, parent, type, date, state in rows:
+            if key == '':
+                source_state = json.loads(state)
+            else:
+                cls = entry_types[type]
+                entry = cls.__new__(cls)
+                # attribute names are interned as when they are set
+                entry.__dict__.update((sys.intern(name), value) for name, value
+                                      in json.loads(state).items())
+                if isinstance(entry, Entries):
+                    entry.entries = containers[key] = dict()
+                share_info(entry, series)
+                identities.add(entry)
+                entry.__dict__['version'] = version
+                entries[key] = entry
+            saved[key] = date
+        # put them into their containers, in order
+        for key, parent, type, date, _ in rows:
+            if key != '' and parent in containers:
+                name = key.rpartition('/')[2]
+                containers[parent][name] = entries[key]
+        self.replace_entries(containers[''])
+        if '' in saved:
+            self.__dict__.update(source_state)
+        self.saved = saved
+        log.info('loaded %d entries of %s from catalog', len(rows), self)
+
+    def replace_entries(self, entries):
+        # compute facets of collections in `entries`, inner ones first, and
+        # make them the entries of the source
+        for name, entry in entries.items():
+            for key, parent, item in reversed(list(walk(entry))):
+                if isinstance(item, Collection):
+                    item.update_facets()
+        self.entries = entries
+        self.update_facets()
+
+    @metrics.catalog_seconds.time(operation='import')
+    def import_entries_file(self):
+        # one-time import of the YAML file used to store entries before the
+        # catalog, it is saved to the catalog after scanning
         entries_file = os.path.join(self.path, '.idaho.yaml')
-        # load entries from YAML file if it exists
         try:
             with open(entries_file, 'r') as f:
-                self.entries = unsafe_load(f)
-            print('  loaded entries file')
+                data = unsafe_load(f)
         except FileNotFoundError:
-            print('  no entries file')
-
+            log.info('no entries of %s in catalog', self)
+            return
+        if set(data) == {'fingerprint', 'entries'}:
+            fingerprint = data['fingerprint']
+            entries = data['entries']
+        else:
+            # old format, entries only
+            fingerprint = None
+            entries = data
+        # loading YAML bypasses dirty tracking
+        for name, entry in entries.items():
+            for key, parent, item in walk(entry):
+                share_info(item)
+                identities.add(item)
+                item.dirty = True
+        self.replace_entries(entries)
+        self.fingerprint = fingerprint
+        self.dirty = True
+        log.info('imported entries file of %s', self)
+
+    @metrics.catalog_seconds.time(operation='save')
     def save(self):
-        # determine name of entries file
-        entries_file = os.path.join(self.path, '.idaho.yaml')
-        # make backup if file exists
-        if os.path.exists(entries_file):
-            os.rename(entries_file, entries_file + '.bk')
-        # dump entries to YAML file
-        with open(entries_file, 'w') as f:
-            dump(self.entries, f, default_flow_style=False, sort_keys=False)
-        print('  saved entries file')
+        # write changed entries to the catalog, in a single transaction
+        with self.save_lock:
+            rows = []
+            series = dict()
+            dates = dict()
+            for key, parent, entry in walk(self):
+                date = entry.date()
+                dates[key] = date
+                # the date of a collection changes with its entries
+                if entry.dirty or (self.saved.get(key) != date):
+                    # reset first, so that changes while saving are kept
+                    entry.dirty = False
+                    genres = ([] if isinstance(entry, Collection)
+                              else sorted(entry.filter_genres()))
+                    rows.append((key, parent, entry.type(),
+                                 getattr(entry, 'tmdb_id', None), date,
+                                 genres, json.dumps(entry.state())))
+                    # not a placeholder, see `share_info`
+                    if (isinstance(entry, Season) and entry.info is not None
+                            and entry.info['uid'] is not None):
+                        series[entry.tmdb_id] = json.dumps(
+                            entry.info['series'])
+            removed = [key for key in self.saved if key not in dates]
+            if len(rows) + len(removed) > 0:
+                catalog.update(self.path, rows, removed, series)
+                log.info('saved %d changed and %d removed entries of %s',
+                         len(rows), len(removed), self,
+                         extra={'source': self.title, 'changed': len(rows),
+                                'removed': len(removed)})
+            self.saved = dates
 
     def __repr__(self):
         return f'Source(path="{self.path}", title="{self.title}")'
 
 
+def share_info(entry, series={}):
+    # Compact the information of an entry loaded from the catalog or the
+    # entries file, bypassing dirty tracking. Seasons refer to the shared
+    # series record, which is in `series` (JSON-encoded by TMDb id) unless
+    # the entry still has its own copy.
+    info = getattr(entry, 'info', None)
+    if info is None:
+        return
+    info = compact(info)
+    if isinstance(entry, Season):
+        if 'series' in info:
+            info['series'] = series_records.share(entry.tmdb_id,
+                                                  info['series'])
+        elif entry.tmdb_id in series:
+            info['series'] = series_records.share(
+                entry.tmdb_id, json.loads(series[entry.tmdb_id]))
+        elif series_records.get(entry.tmdb_id) is not None:
+            # loaded by another source
+            info['series'] = series_records.get(entry.tmdb_id)
+        else:
+            # keep the season's own information, and get that of the series
+            # from TMDb again on the next scan
+            info['series'] = placeholder_series(entry)
+            info['uid'] = None
+    entry.__dict__['info'] = info
+
+
+def walk(container, key=''):
+    # iterate over (key, parent key, entry) of a container and its
+    # descendants, where keys are paths relative to the container
+    if key == '':
+        yield key, None, container
+    if not isinstance(container, Entries):
+        return
+    for name, entry in container.entries.items():
+        child = name if key == '' else key + '/' + name
+        yield child, key, entry
+        if isinstance(entry, Entries):
+            yield from walk(entry, child)
+
+
 class Sources(Entries):
 
     sources = None
+    # catalog generation the singleton instance was loaded at, see `attach`
+    generation = None
+    attach_lock = threading.Lock()
 
     @classmethod
     def get(cls):
         # get singleton instance
         if cls.sources is None:
             cls.sources = Sources()
+            if cfg.revalidate_in_background:
+                # serve entries from the catalog in the meantime
+                threading.Thread(target=cls.sources.revalidate,
+                                 name='revalidate', daemon=True).start()
+            else:
+                cls.sources.revalidate()
+        return cls.sources
+
+    @classmethod
+    def attach(cls):
+        # Get singleton instance for a web server process with a separate
+        # indexer process, see `cfg.separate_indexer`. Entries are loaded
+        # from the catalog, and loaded again when the indexer has changed
+        # it; meanwhile concurrent requests are served the previous ones.
+        generation = catalog.generation()
+        if generation == cls.generation:
+            return cls.sources
+        if cls.attach_lock.acquire(blocking=cls.sources is None):
+            try:
+                generation = catalog.generation()
+                if generation != cls.generation:
+                    sources = Sources()
+                    sources.index_entries()
+                    cls.sources = sources
+                    cls.generation = generation
+                    log.info('loaded catalog generation %d', generation)
+            finally:
+                cls.attach_lock.release()
         return cls.sources
 
     def __init__(self):
-        # create `Source` entries from configuration
+        # set when all sources have been revalidated
+        self.revalidated = threading.Event()
+        # pending delayed save
+        self.timer = None
+        self.timer_lock = threading.Lock()
+        # threads loading or revalidating sources, see `concurrently`
+        self.threads = []
+        # create `Source` entries from configuration, and load them
         entries = dict()
         for name, source_folder in cfg.sources.items():
             entries[name] = Source(source_folder, name)
-
-        # store entries
         self.entries = entries
+        self.concurrently(Source.load, 'loading')
+        # add saved searches
+        for name, query in cfg.searches.items():
+            entries[name] = Search(query, name)
+        # add collection of everything
+        if cfg.everything is not None:
+            entries[cfg.everything] = Everything(cfg.everything)
+
+    def each_source(self):
+        # get `Source` entries, without saved searches and everything
+        return [entry for entry in self.entries.values()
+                if isinstance(entry, Source)]
+
+    def locate(self, entry):
+        # get URL path of `entry`, and the entries containing it from its
+        # source down to its parent
+        for name, source in self.entries.items():
+            if not isinstance(source, Source):
+                continue
+            relpath = os.path.relpath(entry.path, source.path)
+            if relpath == '.':
+                return '/' + name, []
+            if relpath.startswith('..'):
+                continue
+            containers = [source]
+            names = relpath.split(os.sep)
+            for part in names[:-1]:
+                containers.append(containers[-1][part])
+            return '/'.join(['', name] + names), containers
+        return None, []
+
+    def entry_changed(self, entry):
+        # `entry` and possibly its contents have been updated, update the
+        # collections it is contained in, the indexes, searches and the
+        # collection of everything
+        url, containers = self.locate(entry)
+        if url is None:
+            return
+        for container in reversed(containers):
+            if isinstance(container, Collection):
+                container.update_facets()
+        documents = [(url if key == '' else url + '/' + key, item)
+                     for key, _, item in walk(entry)
+                     if isinstance(item, (Movie, Series, Season))]
+        index.update(url, documents)
+        sortedindex.index.update(url, documents)
+        for search in self.entries.values():
+            if isinstance(search, (Search, Everything)):
+                search.evaluate()
+
+    def index_entries(self):
+        # index entries loaded from the catalog
+        for source in self.each_source():
+            self.entry_changed(source)
+
+    def revalidate(self):
+        self.index_entries()
+        # revalidate all sources, sharing series information between them,
+        # those that take too long in the background
+        with series_memo.scope():
+            late = self.concurrently(self.revalidate_source, 'revalidating')
+        log.info('revalidated %d of %d sources',
+                 len(self.each_source()) - len(late), len(self.each_source()))
+        self.revalidated.set()
+
+    def revalidate_source(self, source):
+        with series_memo.scope():
+            source.revalidate()
+        self.entry_changed(source)
+
+    def concurrently(self, function, doing):
+        # Call `function` with each source in a thread of its own, so that a
+        # slow or unavailable folder (e.g. a network mount) doesn't delay the
+        # others, and wait up to `cfg.source_timeout` seconds for them. The
+        # sources that take longer are marked as `late` until they are done,
+        # and then indexed; they are returned.
+        lock = threading.Lock()
+        done = set()
+        threads = []
+        for source in self.each_source():
+            def run(source=source):
+                start = time.monotonic()
+                try:
+                    function(source)
+                except Exception:
+                    log.exception('%s %s failed', doing, source,
+                                  extra={'source': source.title,
+                                         'operation': doing})
+                with lock:
+                    done.add(source)
+                    late = source.late
+                    source.late = False
+                seconds = time.monotonic() - start
+                log.info('finished %s %s in %.2f s', doing, source, seconds,
+                         extra={'source': source.title, 'operation': doing,
+                                'seconds': round(seconds, 3), 'late': late})
+                if late:
+                    self.entry_changed(source)
+            # in a copy of the current context, e.g. the series memo
+            thread = threading.Thread(target=contextvars.copy_context().run,
+                                      args=(run,), daemon=True,
+                                      name=f'{doing} {source.title}')
+            thread.start()
+            threads.append((source, thread))
+            self.threads.append(thread)
+        deadline = time.monotonic() + cfg.source_timeout
+        late = []
+        for source, thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+            with lock:
+                if source not in done:
+                    log.warning('%s %s takes longer than %s seconds',
+                                doing, source, cfg.source_timeout,
+                                extra={'source': source.title,
+                                       'operation': doing})
+                    source.late = True
+                    late.append(source)
+        return late
+
+    def join(self):
+        # wait for sources that take longer to load or revalidate
+        for thread in list(self.threads):
+            thread.join()
 
     def save_all(self):
-        # save all sources
-        for name in self.entries:
-            self.entries[name].save()
-        print('saved entries files')
+        # save all sources, which writes only those with changed entries
+        for source in self.each_source():
+            source.save()
+
+    def save_soon(self):
+        # save all sources after `cfg.save_delay` seconds, so that a burst of
+        # changes results in a single write
+        with self.timer_lock:
+            if self.timer is None:
+                self.timer = threading.Timer(cfg.save_delay, self.save_timed)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def save_timed(self):
+        with self.timer_lock:
+            self.timer = None
+        self.save_all()
 
     def __repr__(self):
         return 'Sources()'
@@ -444,14 +1252,13 @@ class Sources(Entries):
 # ––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––––
 
 
-def scan_episodes(path, season_number):
-    # get folder contents
-    names = os.listdir(path)
+def scan_episodes(folder, season_number):
+    # episodes in the snapshot `folder`
     # filter out hidden
-    names = [name for name in names if not name.startswith('.')]
+    names = [name for name in folder.names if not name.startswith('.')]
     # filter for video files
     names = [name for name in names
-             if os.path.isfile(os.path.join(path, name))
+             if folder.isfile(name)
              and (os.path.splitext(name)[1] in cfg.video_extensions)]
     # extract episode numbers
     pattern = r'(?i)S(\d{1,2}) ?E(\d{1,2})(?:(?:-E|E|,)(\d{1,2}))?'
@@ -463,14 +1270,15 @@ def scan_episodes(path, season_number):
             episode = f'Episode {int(match.group(2)):2}'
             if match.group(3) is not None:
                 episode += f'–{int(match.group(3))}'
-        episodes.append((episode, name))
+        episodes.append([episode, name])
     # sort episodes
     episodes = sorted(episodes, key=lambda item: item[0])
     return episodes
 
 
+@metrics.probe_seconds.time(probe='processed_folder_season')
 def probe_processed_folder_season(name, path, tmdb_id):
-    print(f'    probing "{name}" as processed_folder_season')
+    log.debug('probing "%s" as processed_folder_season', name)
     # check pattern: Season, #
     pattern = r'Season ([0-9]+)'
     match = re.fullmatch(pattern, name)
@@ -481,8 +1289,9 @@ def probe_processed_folder_season(name, path, tmdb_id):
     return Season(tmdb_id, season_number, os.path.join(path, name))
 
 
+@metrics.probe_seconds.time(probe='processed_folder_collection')
 def probe_processed_folder_collection(name, path):
-    print(f'    probing "{name}" as processed_folder_collection')
+    log.debug('probing "%s" as processed_folder_collection', name)
     # check pattern: ... collection
     pattern = r'(.+) collection'
     match = re.fullmatch(pattern, name)
@@ -493,8 +1302,9 @@ def probe_processed_folder_collection(name, path):
     return Collection(os.path.join(path, name), title)
 
 
+@metrics.probe_seconds.time(probe='torrent_folder_movie')
 def probe_torrent_folder_movie(name, path):
-    print(f'    probing "{name}" as torrent_folder_movie')
+    log.debug('probing "%s" as torrent_folder_movie', name)
     # check pattern: title, year, extra; separated by dots
     pattern = r'(.*)\.([1-3][0-9]{3})\.(.*)'
     match = re.fullmatch(pattern, name)
@@ -519,8 +1329,9 @@ def probe_torrent_folder_movie(name, path):
     return Movie(result['id'], os.path.join(path, name))
 
 
+@metrics.probe_seconds.time(probe='torrent_folder_season')
 def probe_torrent_folder_season(name, path):
-    print(f'    probing "{name}" as torrent_folder_season')
+    log.debug('probing "%s" as torrent_folder_season', name)
     # check pattern: title, S#, extra; separated by dots
     pattern = r'(.*)\.S([0-9]{2})\.(.*)'
     match = re.fullmatch(pattern, name)
@@ -548,20 +1359,21 @@ def probe_torrent_folder_season(name, path):
     if len(results) == 0:
         return None
     result = results[0]
-    print(result)
+    log.debug('found %s', result)
     for r in results:
         # It's confusing that in TMDb, series have `name`s,
         # though movies have `title`s.
         if r['name'].casefold() == title.casefold():
             result = r
             break
-    print(result)
+    log.debug('found %s', result)
     # return entry
     return Season(result['id'], season_number, os.path.join(path, name))
 
 
+@metrics.probe_seconds.time(probe='processed_file_movie')
 def probe_processed_file_movie(name, path):
-    print(f'    probing "{name}" as processed_file_movie')
+    log.debug('probing "%s" as processed_file_movie', name)
     # check pattern: director(s) - title (extra) - year
     pattern = r'.* - ([^\(]*) (?:\((.*)\) )?- ([1-3][0-9]{3})\..*'
     match = re.fullmatch(pattern, name)
@@ -586,8 +1398,9 @@ def probe_processed_file_movie(name, path):
     return Movie(result['id'], os.path.join(path, name))
 
 
+@metrics.probe_seconds.time(probe='processed_folder_series')
 def probe_processed_folder_series(name, path):
-    print(f'    probing "{name}" as processed_folder_series')
+    log.debug('probing "%s" as processed_folder_series', name)
     # look series up
     response = search.tv(query=name, include_adult=True)
     results = response['results']
@@ -602,34 +1415,37 @@ def probe_processed_folder_series(name, path):
     return Series(result['id'], os.path.join(path, name))
 
 
-def scan_folder(path, old_entries, folder_probes, file_probes):
-    print(f'  scanning "{path}"')
-    # get file & folder names
-    names = os.listdir(path)
+def scan_folder(folder, old_entries, folder_probes, file_probes, skipped):
+    # scan the snapshot `folder`; names that cannot be identified or updated
+    # are appended to `skipped`
+    path = folder.path
+    log.info('scanning "%s"', path)
     # filter out hidden
-    names = [name for name in names if not name.startswith('.')]
+    names = [name for name in folder.names if not name.startswith('.')]
     # filter out non-video files (keep folders)
     names = [name for name in names
-             if os.path.isdir(os.path.join(path, name))
+             if folder.isdir(name)
              or (os.path.splitext(name)[1] in cfg.video_extensions)]
     # filter out names for which there are no probes
     if len(folder_probes) == 0:
-        names = [name for name in names
-                 if not os.path.isdir(os.path.join(path, name))]
+        names = [name for name in names if not folder.isdir(name)]
     if len(file_probes) == 0:
-        names = [name for name in names
-                 if not os.path.isfile(os.path.join(path, name))]
+        names = [name for name in names if not folder.isfile(name)]
 
     # update entry names
     entries = {name: old_entries.get(name, None) for name in names}
     removed = list(set(old_entries) - set(entries))
     for name in removed:
-        print('    removed', old_entries[name])
-
-    # create new entries
-    for name, entry in entries.items():
-        if entry is None:
-            if os.path.isdir(os.path.join(path, name)):
+        log.info('removed %s', old_entries[name])
+        identities.retire(old_entries[name])
+
+    # create new entries, and take movies and seasons over from where the
+    # same main video file was before a rename or move
+    def identify(name):
+        jobs.count('probed')
+        entry = None
+        try:
+            if folder.isdir(name):
                 # folder
                 for probe in folder_probes:
                     if entry is None:
@@ -639,17 +1455,79 @@ def scan_folder(path, old_entries, folder_probes, file_probes):
                 for probe in file_probes:
                     if entry is None:
                         entry = probe(name, path)
-            if entry is None:
-                print('      *** unable to identify')
-                entry = Unknown(os.path.join(path, name))
-            print('      added', entry)
+            if isinstance(entry, (Movie, Season)):
+                identity, moved = identities.find(os.path.join(path, name),
+                                                  type(entry))
+                if moved is not None:
+                    log.info('%s moved to "%s"', moved, name)
+                    entry = moved.moved(os.path.join(path, name))
+                    if identity is moved.identity:
+                        # found by inode, i.e. moved rather than copied
+                        identities.remove(moved)
+                else:
+                    entry.identity = identity
+        except tmdbclient.Offline:
+            # leave identification to a later scan
+            log.warning('offline, skipped "%s"', name)
+            return None
+        except Exception as e:
+            # e.g. TMDb or file system errors, leave to a later scan as well
+            log.warning('error, skipped "%s": %r', name, e)
+            jobs.count('errors')
+            metrics.scan_errors_total.inc()
+            return None
+        if entry is None:
+            log.warning('unable to identify "%s"', name)
+            entry = Unknown(os.path.join(path, name))
+        log.info('added %s', entry)
+        return entry
+
+    new_names = [name for name, entry in entries.items() if entry is None]
+    for name, entry in zip(new_names, scan_map(identify, new_names)):
+        if entry is not None:
             entries[name] = entry
+        else:
+            del entries[name]
+            skipped.append(name)
+
+    return update_entries(entries, skipped)
+
+
+def update_entries(entries, skipped):
+    # names of entries that cannot be updated are appended to `skipped`, and
+    # those without earlier information are removed
+    entries = entries.copy()
 
     # update entry information
-    for name, entry in entries.items():
-        if entry is not None:
-            print('  adding info to', entry)
-            entry.add_info()
+    def add_info(entry):
+        log.debug('adding info to %s', entry)
+        try:
+            with metrics.add_info_seconds.time(type=entry.type()):
+                entry.add_info()
+            identities.update(entry)
+        except tmdbclient.Offline:
+            log.warning('offline, skipped %s', entry)
+            return False
+        except Exception as e:
+            log.warning('error, skipped %s: %r', entry, e)
+            jobs.count('errors')
+            metrics.scan_errors_total.inc()
+            return False
+        jobs.count('updated')
+        # download poster for tile in the background
+        if getattr(entry, 'info', None) is not None:
+            posters.store.prefetch(entry.info.get('poster_url'))
+        return True
+
+    names = list(entries)
+    for name, ok in zip(names, scan_map(add_info, list(entries.values()))):
+        if not ok:
+            skipped.append(name)
+            # keep entries that can still be shown with earlier information
+            entry = entries[name]
+            if not (isinstance(entry, Collection)
+                    or getattr(entry, 'info', None) is not None):
+                del entries[name]
 
     # sort entries
     entries = dict(sorted(entries.items(),
@@ -658,6 +1536,193 @@ def scan_folder(path, old_entries, folder_probes, file_probes):
     return entries
 
 
+class Identities:
+    # Index of movies and seasons, across all sources, by the identity of
+    # their main video file: device, inode, size and a hash of the first and
+    # last `hash_bytes` of the file. A renamed or moved file is found by its
+    # inode, a copy by its size and hash (except for small files, which may
+    # well be equal), so that its entry and information can be taken over
+    # without probing; see `scan_folder`. Entries that have been removed stay
+    # in the index for `removed_ttl` seconds, so that it doesn't matter
+    # whether the old or the new location is scanned first.
+
+    hash_bytes = 64 * 1024
+    removed_ttl = 3600
+    # files modified less than this many seconds ago may still be downloaded
+    # or copied, and are identified later
+    settle_seconds = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = dict()
+        # (time of removal, entry) of removed entries, by id of the entry
+        self.removed = dict()
+
+    def add(self, entry):
+        # index entry by its identity, if it has one
+        if entry.identity is None:
+            return
+        device, inode, size, hash = entry.identity
+        with self.lock:
+            self.entries[('inode', device, inode, size)] = entry
+            if hash is not None:
+                self.entries[('content', size, hash)] = entry
+
+    def remove(self, entry):
+        # forget entry
+        with self.lock:
+            self.removed.pop(id(entry), None)
+            if entry.identity is None:
+                return
+            device, inode, size, hash = entry.identity
+            for key in [('inode', device, inode, size),
+                        ('content', size, hash)]:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+
+    def retire(self, entry):
+        # forget the movies and seasons of a removed entry after
+        # `removed_ttl` seconds, and those removed longer ago now
+        now = time.monotonic()
+        with self.lock:
+            for _, _, item in walk(entry):
+                if isinstance(item, (Movie, Season)):
+                    self.removed[id(item)] = (now, item)
+            expired = [item for removed, item in self.removed.values()
+                       if now - removed > self.removed_ttl]
+        for item in expired:
+            self.remove(item)
+
+    def update(self, entry):
+        # determine identity of a movie or season with information, if it
+        # doesn't have one, and index it
+        if not (isinstance(entry, (Movie, Season))
+                and entry.info is not None):
+            return
+        if entry.identity is None:
+            identity, _ = self.identify(entry.path)
+            if identity is None:
+                return
+            entry.identity = identity
+        self.add(entry)
+
+    def find(self, path, type):
+        # get identity of the main video file of `path`, and the entry of
+        # `type` (Movie or Season) it belonged to or None
+        identity, entry = self.identify(path)
+        if not isinstance(entry, type):
+            entry = None
+        return identity, entry
+
+    def identify(self, path):
+        # get identity of the main video file of `path` and the entry it
+        # belongs to, hashing the file only if it is not found by inode
+        filename = main_video_file(path)
+        if filename is None:
+            return None, None
+        try:
+            with metrics.scan_seconds.time(operation='stat'):
+                st = os.stat(filename)
+            with self.lock:
+                entry = self.entries.get(('inode', st.st_dev, st.st_ino,
+                                          st.st_size))
+            if entry is not None:
+                return entry.identity, entry
+            if time.time() - st.st_mtime < self.settle_seconds:
+                log.debug('not identifying "%s", recently modified',
+                          filename)
+                return None, None
+            if st.st_size <= 2 * self.hash_bytes:
+                return [st.st_dev, st.st_ino, st.st_size, None], None
+            hash = hashlib.sha256()
+            with metrics.scan_seconds.time(operation='hash'), \
+                    open(filename, 'rb') as f:
+                hash.update(f.read(self.hash_bytes))
+                f.seek(-self.hash_bytes, os.SEEK_END)
+                hash.update(f.read(self.hash_bytes))
+        except OSError as e:
+            log.debug('cannot identify "%s": %r', filename, e)
+            return None, None
+        identity = [st.st_dev, st.st_ino, st.st_size, hash.hexdigest()]
+        with self.lock:
+            entry = self.entries.get(('content', st.st_size, identity[3]))
+        return identity, entry
+
+
+identities = Identities()
+
+
+def main_video_file(path):
+    # path itself if it is a video file, the largest video file in it if it
+    # is a folder, or None
+    if os.path.splitext(path)[1] in cfg.video_extensions:
+        return path if os.path.isfile(path) else None
+    try:
+        folder = snapshots.get(path)
+        names = [name for name in folder.files
+                 if os.path.splitext(name)[1] in cfg.video_extensions]
+        if len(names) == 0:
+            return None
+        return os.path.join(path, max(names, key=folder.size))
+    except OSError:
+        return None
+
+
+# worker pool shared by all scans, created on first use
+scan_pool = None
+scan_pool_lock = threading.Lock()
+# marks threads that are executing a task of the pool
+scan_worker = threading.local()
+
+
+def scan_map(function, items):
+    # apply `function` to all `items` and return the results in order,
+    # using the worker pool if `cfg.scan_workers` > 1
+    global scan_pool
+    if (cfg.scan_workers <= 1) or getattr(scan_worker, 'active', False):
+        # Nested scans (e.g. `Series.add_info` scanning for seasons within a
+        # worker) run sequentially, so that the bounded pool cannot deadlock
+        # with all workers waiting for tasks that have no worker left.
+        return [function(item) for item in items]
+    with scan_pool_lock:
+        if scan_pool is None:
+            scan_pool = ThreadPoolExecutor(max_workers=cfg.scan_workers,
+                                           thread_name_prefix='scan')
+
+    def task(context, item):
+        scan_worker.active = True
+        try:
+            return context.run(function, item)
+        finally:
+            scan_worker.active = False
+
+    # run each task in a copy of the current context, so that e.g. the
+    # progress of a job is counted
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(scan_pool.map(task, contexts, items))
+
+
+def subtitle_files(path, prefix=''):
+    # paths of subtitle files in folder whose names start with `prefix`
+    try:
+        folder = snapshots.get(path)
+    except OSError:
+        return []
+    return [os.path.join(path, name) for name in folder.names
+            if folder.isfile(name) and name.startswith(prefix)
+            and os.path.splitext(name)[1].lower() in subtitle_extensions]
+
+
+def sidecar_subtitles(filename):
+    # paths of subtitle files of a video file: named like it, next to it or
+    # in a `Subs` folder, or within `Subs/<name>` (as in RARBG's series)
+    path, name = os.path.split(filename)
+    stem = os.path.splitext(name)[0]
+    subs = os.path.join(path, 'Subs')
+    return (subtitle_files(path, stem) + subtitle_files(subs, stem)
+            + subtitle_files(os.path.join(subs, stem)))
+
+
 def mpv_play(filename, sub_auto_all=False, subs=[]):
     cmd = ['mpv', '--fs', '--save-position-on-quit']
     if sub_auto_all:
@@ -665,7 +1730,5 @@ def mpv_play(filename, sub_auto_all=False, subs=[]):
     if len(subs) > 0:
         cmd.append('--sub-file-paths=' + ':'.join(subs))
     cmd.append(filename)
-    print('executing', ' '.join(cmd))
+    log.info('executing %s', ' '.join(cmd))
     subprocess.Popen(cmd)
-
-Sources.get()
\ No newline at end of file
@@ -0,0 +1,126 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# all metrics, in order of definition
+registry = []
+
+# upper bounds of histogram buckets in seconds
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+           5, 10, 30)
+
+
+class Metric:
+    # a metric with values by label values, in Prometheus' text format
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = dict()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join(f'{label}="{escape(value)}"'
+                              for label, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            lines.extend(self.samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self, key, value):
+        return [f'{self.name}{self.label_text(key)} {value}']
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                # counts by bucket, sum, count
+                self.values[key] = [[0] * len(buckets), 0, 0]
+            counts, total, count = self.values[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = [counts, total + value, count + 1]
+
+    @contextmanager
+    def time(self, **labels):
+        # record duration of a `with` block, or of calls of a function it
+        # decorates
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self, key, value):
+        counts, total, count = value
+        lines = [f'{self.name}_bucket'
+                 f'{self.label_text(key, [("le", bound)])} {n}'
+                 for bound, n in zip(buckets, counts)]
+        lines.append(f'{self.name}_bucket'
+                     f'{self.label_text(key, [("le", "+Inf")])} {count}')
+        lines.append(f'{self.name}_sum{self.label_text(key)} {total}')
+        lines.append(f'{self.name}_count{self.label_text(key)} {count}')
+        return lines
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def render():
+    # all metrics in Prometheus' text format
+    return '\n'.join(line for metric in registry
+                     for line in metric.render()) + '\n'
+
+
+request_seconds = Histogram(
+    'idaho_request_seconds', 'Duration of HTTP requests.', ['route'])
+render_seconds = Histogram(
+    'idaho_render_seconds', 'Duration of template rendering.', ['template'])
+tmdb_request_seconds = Histogram(
+    'idaho_tmdb_request_seconds', 'Duration of requests to TMDb.',
+    ['endpoint'])
+tmdb_cache_total = Counter(
+    'idaho_tmdb_cache_total', 'TMDb responses from the cache or fetched.',
+    ['endpoint', 'result'])
+probe_seconds = Histogram(
+    'idaho_probe_seconds', 'Duration of probing names.', ['probe'])
+add_info_seconds = Histogram(
+    'idaho_add_info_seconds', 'Duration of adding information to entries.',
+    ['type'])
+scan_seconds = Histogram(
+    'idaho_scan_seconds', 'Duration of file system operations of scans.',
+    ['operation'])
+scan_errors_total = Counter(
+    'idaho_scan_errors_total', 'Names skipped in scans because of errors.')
+catalog_seconds = Histogram(
+    'idaho_catalog_seconds', 'Duration of catalog operations.',
+    ['operation'])
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import requests
+
+import cfg
+
+log = logging.getLogger(__name__)
+
+# TMDb's pre-resized variants used by the templates
+sizes = ['w185', 'w342']
+
+
+class PosterStore:
+    # local copies of TMDb posters
+    #
+    # Images are stored under their content hash, and an index maps poster
+    # URL and size to the hash. The least recently used images are removed if
+    # the total size exceeds the maximum.
+
+    def __init__(self, dir, size):
+        self.dir = dir
+        # maximum total size in MB
+        self.size = size * 1e6
+        os.makedirs(dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(dir, 'index.db'),
+                                  check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS posters ('
+                        'url TEXT, size TEXT, hash TEXT, bytes INTEGER, '
+                        'used REAL, PRIMARY KEY (url, size))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS posters_used '
+                        'ON posters (used)')
+        self.total = self.db.execute(
+            'SELECT COALESCE(SUM(bytes), 0) FROM posters').fetchone()[0]
+        # background downloads
+        self.queue = queue.Queue()
+        self.queued = set()
+        threading.Thread(target=self.prefetcher, name='posters',
+                         daemon=True).start()
+
+    def filename(self, hash):
+        return os.path.join(self.dir, hash[:2], hash + '.jpg')
+
+    def get(self, url, size):
+        # get hash of poster, downloading it if necessary; `None` if it is
+        # not available
+        with self.lock:
+            row = self.db.execute('SELECT hash FROM posters '
+                                  'WHERE url = ? AND size = ?',
+                                  (url, size)).fetchone()
+            if row is not None and os.path.exists(self.filename(row[0])):
+                self.db.execute('UPDATE posters SET used = ? '
+                                'WHERE url = ? AND size = ?',
+                                (time.time(), url, size))
+                return row[0]
+        if cfg.tmdb_offline:
+            return None
+        return self.download(url, size)
+
+    def download(self, url, size):
+        try:
+            response = requests.get(f'{cfg.tmdb_image_url}/{size}{url}',
+                                    timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            log.warning('poster download failed: %s', e)
+            return None
+        data = response.content
+        hash = hashlib.sha256(data).hexdigest()
+        filename = self.filename(hash)
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(filename + '.tmp', filename)
+        with self.lock:
+            old = self.db.execute('SELECT bytes FROM posters '
+                                  'WHERE url = ? AND size = ?',
+                                  (url, size)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO posters '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (url, size, hash, len(data), time.time()))
+            self.total += len(data) - (old[0] if old is not None else 0)
+            if self.total > self.size:
+                self.evict(keep=(url, size))
+        return hash
+
+    def evict(self, keep):
+        # remove least recently used posters until 10% below maximum size,
+        # except for the one to `keep`
+        rows = self.db.execute('SELECT url, size, hash, bytes FROM posters '
+                               'ORDER BY used').fetchall()
+        count = 0
+        for url, size, hash, bytes in rows:
+            if self.total <= 0.9 * self.size:
+                break
+            if (url, size) == keep:
+                continue
+            self.db.execute('DELETE FROM posters WHERE url = ? AND size = ?',
+                            (url, size))
+            self.total -= bytes
+            count += 1
+            # the same image may be stored for another URL or size
+            if self.db.execute('SELECT 1 FROM posters WHERE hash = ?',
+                               (hash,)).fetchone() is None:
+                try:
+                    os.remove(self.filename(hash))
+                except FileNotFoundError:
+                    pass
+        log.info('evicted %d posters', count)
+
+    def prefetch(self, url, size='w185'):
+        # download poster in the background
+        if url is None:
+            return
+        with self.lock:
+            if (url, size) in self.queued:
+                return
+            self.queued.add((url, size))
+        self.queue.put((url, size))
+
+    def prefetcher(self):
+        while True:
+            url, size = self.queue.get()
+            try:
+                self.get(url, size)
+            finally:
+                with self.lock:
+                    self.queued.discard((url, size))
+
+
+store = PosterStore(os.path.join(cfg.dir, 'posters'), cfg.poster_cache_size)
@@ -0,0 +1,142 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+# `info` fields that are searched, by entry type
+fields = {
+    'Movie':  ['title', 'title_en', 'directors', 'writers', 'actors',
+               'countries', 'year'],
+    'Series': ['name', 'name_en', 'creators', 'actors', 'countries', 'years'],
+}
+
+
+def tokenize(text):
+    # split text into words, ignoring case and diacritics
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r'\w+', text.casefold())
+
+
+def entry_text(entry):
+    # get searchable text of an entry
+    info = getattr(entry, 'info', None)
+    if info is None:
+        return ''
+    type = entry.type()
+    if type == 'Season':
+        # a season is found by its series
+        return ' '.join([entry_text_fields(info['series'], 'Series'),
+                         info['year']])
+    if type in fields:
+        return entry_text_fields(info, type)
+    return ''
+
+
+def entry_text_fields(info, type):
+    return ' '.join(str(info[field]) for field in fields[type]
+                    if info.get(field) is not None)
+
+
+def subtree(urls, url):
+    # Get the positions in sorted URL paths `urls` of those below `url`, as
+    # (start, end), and that of `url` itself or None. '0' follows '/', so
+    # '/a0' ends the range of '/a/...', and '/a b' (which is sorted between
+    # '/a' and '/a/...') is not in it.
+    start = bisect_left(urls, url + '/')
+    end = bisect_left(urls, url + '0', start)
+    i = bisect_left(urls, url, 0, start)
+    return start, end, i if i < start and urls[i] == url else None
+
+
+class SearchIndex:
+    # inverted index of entries, by URL path
+
+    # number of entries above which an update appends and sorts
+    bulk_size = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # entry and its words, by URL path
+        self.documents = dict()
+        # sorted URL paths, to find those below a URL path
+        self.urls = []
+        # URL paths, by word
+        self.postings = dict()
+        # sorted words, for prefix matching
+        self.words = []
+        # incremented on every change
+        self.generation = 0
+
+    def update(self, url, documents):
+        # replace the entries at `url` and below by `documents`, an iterable
+        # of (url, entry)
+        with self.lock:
+            start, end, i = subtree(self.urls, url)
+            for key in self.urls[start:end]:
+                self.remove(key)
+            del self.urls[start:end]
+            if i is not None:
+                self.remove(url)
+                del self.urls[i]
+            added = [key for key, entry in documents if self.add(key, entry)]
+            # many entries, e.g. of a source loaded from the catalog, are
+            # faster appended and sorted at once
+            if len(added) > self.bulk_size:
+                self.urls.extend(added)
+                self.urls.sort()
+            else:
+                for key in added:
+                    insort(self.urls, key)
+            self.generation += 1
+
+    def add(self, url, entry):
+        # index entry, return whether it has words
+        words = set(tokenize(entry_text(entry)))
+        if len(words) == 0:
+            return False
+        self.documents[url] = (entry, words)
+        for word in words:
+            if word not in self.postings:
+                self.postings[word] = set()
+                insort(self.words, word)
+            self.postings[word].add(url)
+        return True
+
+    def remove(self, url):
+        _, words = self.documents.pop(url)
+        for word in words:
+            self.postings[word].discard(url)
+            if len(self.postings[word]) == 0:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def search(self, query):
+        # get (url, entry) of entries that contain words starting with each
+        # of the words of the query
+        urls = None
+        with self.lock:
+            # longer words are more selective
+            for term in sorted(set(tokenize(query)), key=len, reverse=True):
+                if urls is not None and len(urls) < 1000:
+                    # checking few candidates is faster than expanding a
+                    # short prefix
+                    urls = {url for url in urls
+                            if any(word.startswith(term)
+                                   for word in self.documents[url][1])}
+                else:
+                    matches = set()
+                    i = bisect_left(self.words, term)
+                    while (i < len(self.words)
+                           and self.words[i].startswith(term)):
+                        matches |= self.postings[self.words[i]]
+                        i += 1
+                    urls = matches if urls is None else urls & matches
+                if len(urls) == 0:
+                    break
+            if urls is None:
+                return []
+            return [(url, self.documents[url][0]) for url in urls]
+
+
+index = SearchIndex()
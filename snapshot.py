@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+
+import metrics
+
+
+def folder_fingerprint(path):
+    # Changes whenever names are added to, removed from or renamed within the
+    # folder, which updates its modification and change times, or the folder
+    # is replaced. The number of links only counts its subfolders (+ 2 on
+    # POSIX). Changes within the granularity of the times after a listing
+    # go unnoticed until the next change, but checking needs a single `stat`
+    # instead of listing the folder.
+    with metrics.scan_seconds.time(operation='stat'):
+        st = os.stat(path)
+    return [st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_nlink]
+
+
+class Snapshot:
+    # names of the folders and files in a folder, from a single `os.scandir`
+    # (which on most systems doesn't need to `stat` each name); sizes are
+    # obtained on demand and kept for `stat_ttl` seconds
+
+    stat_ttl = 60
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.dirs = set()
+        self.files = set()
+        with metrics.scan_seconds.time(operation='list'), \
+                os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        self.dirs.add(entry.name)
+                    elif entry.is_file():
+                        self.files.add(entry.name)
+                except OSError:
+                    # e.g. broken symbolic link
+                    pass
+        self.names = sorted(self.dirs | self.files)
+        # stat results with the time they were obtained, by name
+        self.stats = dict()
+
+    def isdir(self, name):
+        return name in self.dirs
+
+    def isfile(self, name):
+        return name in self.files
+
+    def stat(self, name):
+        now = time.monotonic()
+        if name in self.stats:
+            obtained, st = self.stats[name]
+            if now - obtained < self.stat_ttl:
+                return st
+        with metrics.scan_seconds.time(operation='stat'):
+            st = os.stat(os.path.join(self.path, name))
+        self.stats[name] = (now, st)
+        return st
+
+    def size(self, name):
+        return self.stat(name).st_size
+
+
+class SnapshotCache:
+    # snapshots by folder path, which are reused as long as the folder has
+    # not changed, see `folder_fingerprint`
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = dict()
+
+    def get(self, path, fingerprint=None):
+        # get snapshot of folder, raises `NotADirectoryError` for a file;
+        # `fingerprint` is that of the folder if it was just taken
+        if fingerprint is None:
+            fingerprint = folder_fingerprint(path)
+        with self.lock:
+            snapshot = self.snapshots.get(path)
+        if snapshot is None or snapshot.fingerprint != fingerprint:
+            snapshot = Snapshot(path, fingerprint)
+            with self.lock:
+                self.snapshots[path] = snapshot
+        return snapshot
+
+    def invalidate(self, path):
+        # forget snapshots of folder and the folders within it
+        prefix = os.path.join(path, '')
+        with self.lock:
+            for key in [key for key in self.snapshots
+                        if key == path or key.startswith(prefix)]:
+                del self.snapshots[key]
+
+
+snapshots = SnapshotCache()
@@ -0,0 +1,181 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from searchindex import subtree
+
+
+def title(entry):
+    # title of an entry, for sorting by name
+    info = entry.info
+    if entry.type() == 'Movie':
+        return info['title']
+    if entry.type() == 'Season':
+        return info['series']['name'] + ' ' + info['name']
+    return info['name']
+
+
+# sort keys of entries, by sort
+sort_keys = {
+    'date': lambda entry: entry.date(),
+    'name': lambda entry: title(entry).casefold(),
+}
+
+
+class SortedIndex:
+    # Entries of all sources by URL path, kept in order by each sort key, in
+    # a list of all entries and in one for each genre. Entries are inserted
+    # and removed by bisection, so that changes don't need sorting, and pages
+    # are read from the lists, so that paging doesn't need sorting either.
+    # Entries that are unchanged in an update stay in place.
+
+    # number of entries above which an update appends and sorts
+    bulk_size = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # entries by URL path, to be read only by other modules
+        self.entries = dict()
+        # sorted URL paths, to find those below a URL path
+        self.urls = []
+        # sort keys and filter genres of entries, by URL path
+        self.keys = dict()
+        self.genres = dict()
+        # sorted lists of (sort key, URL path), by sort and genre (`None` for
+        # all entries)
+        self.lists = {sort: {None: []} for sort in sort_keys}
+        # number of entries by genre and by type
+        self.genre_counts = dict()
+        self.type_counts = dict()
+        # incremented on every change
+        self.generation = 0
+
+    def update(self, url, documents):
+        # replace the entries at `url` and below by `documents`, an iterable
+        # of (url, entry)
+        new = dict()
+        for key, entry in documents:
+            if getattr(entry, 'info', None) is not None:
+                new[key] = (entry, {sort: sort_key(entry) for sort, sort_key
+                                    in sort_keys.items()},
+                            set(entry.filter_genres()))
+        with self.lock:
+            start, end, i = subtree(self.urls, url)
+            old = self.urls[start:end] + ([url] if i is not None else [])
+            removed = [key for key in old
+                       if key not in new or new[key] != (self.entries[key],
+                                                         self.keys[key],
+                                                         self.genres[key])]
+            # many entries, e.g. of a source loaded from the catalog, are
+            # faster filtered out, or appended and sorted, at once
+            bulk = len(removed) > self.bulk_size
+            for key in removed:
+                self.remove(key, bulk)
+            if bulk:
+                removed = set(removed)
+                self.urls = [key for key in self.urls if key not in removed]
+                for lists in self.lists.values():
+                    for genre, items in list(lists.items()):
+                        items = [item for item in items
+                                 if item[1] not in removed]
+                        if genre is not None and len(items) == 0:
+                            del lists[genre]
+                        else:
+                            lists[genre] = items
+            added = [key for key in new if key not in self.entries]
+            bulk = len(added) > self.bulk_size
+            for key in added:
+                self.add(key, *new[key], bulk)
+            if bulk:
+                self.urls.sort()
+                for lists in self.lists.values():
+                    for items in lists.values():
+                        items.sort()
+            if len(removed) + len(added) > 0:
+                self.generation += 1
+
+    def add(self, url, entry, keys, genres, bulk=False):
+        # insert entry, or append it if `bulk`
+        insert = list.append if bulk else insort
+        self.entries[url] = entry
+        insert(self.urls, url)
+        self.keys[url] = keys
+        self.genres[url] = genres
+        for sort, key in keys.items():
+            lists = self.lists[sort]
+            insert(lists[None], (key, url))
+            for genre in genres:
+                insert(lists.setdefault(genre, []), (key, url))
+        for genre in genres:
+            self.genre_counts[genre] = self.genre_counts.get(genre, 0) + 1
+        type = entry.type()
+        self.type_counts[type] = self.type_counts.get(type, 0) + 1
+
+    def remove(self, url, bulk=False):
+        # remove entry, except from the lists if `bulk`
+        entry = self.entries.pop(url)
+        keys = self.keys.pop(url)
+        genres = self.genres.pop(url)
+        if not bulk:
+            del self.urls[bisect_left(self.urls, url)]
+            for sort, key in keys.items():
+                lists = self.lists[sort]
+                for genre in [None] + list(genres):
+                    items = lists[genre]
+                    del items[bisect_left(items, (key, url))]
+                    if genre is not None and len(items) == 0:
+                        del lists[genre]
+        for genre in genres:
+            self.genre_counts[genre] -= 1
+            if self.genre_counts[genre] == 0:
+                del self.genre_counts[genre]
+        type = entry.type()
+        self.type_counts[type] -= 1
+        if self.type_counts[type] == 0:
+            del self.type_counts[type]
+
+    def facets(self):
+        # genres and types with counts, and range of dates, as
+        # `media.Collection.facets`
+        with self.lock:
+            items = self.lists['date'][None]
+            # unknown dates '?' are last
+            end = bisect_left(items, ('?',))
+            return {'genres': dict(sorted(self.genre_counts.items())),
+                    'types': dict(self.type_counts),
+                    'dates': ([items[0][0], items[end - 1][0]] if end > 0
+                              else None)}
+
+    def page(self, cursor, sort, genre, types, size):
+        # Get URL paths of up to `size` entries following `cursor`, and the
+        # cursor of the next page, as `media.Collection.page`; `types` are
+        # the entry types to include, or None for all.
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        urls = []
+        next = None
+        # position of the last entry of the page
+        last = None
+        with self.lock:
+            items = self.lists[sort].get(genre, [])
+            if descending:
+                end = (len(items) if cursor is None
+                       else bisect_left(items, tuple(cursor)))
+                order = range(end - 1, -1, -1)
+            else:
+                start = (0 if cursor is None
+                         else bisect_right(items, tuple(cursor)))
+                order = range(start, len(items))
+            for i in order:
+                key, url = items[i]
+                if types is None or self.entries[url].type() in types:
+                    if len(urls) == size:
+                        if last is not None:
+                            next = list(items[last])
+                        break
+                    urls.append(url)
+                    last = i
+        return urls, next
+
+
+# movies, series and seasons of all sources
+index = SortedIndex()
@@ -1,11 +1,83 @@
 // trigger server-side actions
 
 function refresh() {
-    // server-side refresh, then reload page
-    fetch('?refresh').then(value => window.location.reload())
+    // start server-side refresh, show its progress, and reload page when it
+    // is done
+    fetch('?refresh')
+        .then(response => response.json())
+        .then(job => {
+            let progress = document.querySelector('div.progress')
+            if (progress === null) {
+                document.body.insertAdjacentHTML('beforeend',
+                    '<div class="progress"></div>')
+                progress = document.querySelector('div.progress')
+            }
+            const events = new EventSource('/jobs/' + job.id)
+            events.onmessage = event => {
+                const status = JSON.parse(event.data)
+                progress.textContent = `refreshing: ${status.probed} probed, `
+                    + `${status.updated} updated, ${status.errors} errors`
+                if (status.done) {
+                    events.close()
+                    window.location.reload()
+                }
+            }
+        })
 }
 
 function open() {
     // server-side open folder
     fetch('?open')
 }
+
+
+// load entries of a collection page by page
+
+let cursor = null   // cursor of the next page, null if there is none
+let loading = false
+let request = 0     // number of the latest request, to ignore older ones
+
+function loadEntries(reset) {
+    // fetch the next page of entries, or the first one if `reset`
+    if (!reset && (cursor === null || loading)) return
+    const params = new URLSearchParams(window.location.search)
+    params.set('entries', '')
+    if (!reset) params.set('cursor', cursor)
+    const genre = document.querySelector('input[name=genres]:checked')
+    if (genre.dataset.genre) params.set('genre', genre.dataset.genre)
+    const type = document.querySelector('input[name=mediatypes]:checked')
+    if (type.dataset.type) params.set('type', type.dataset.type)
+    const sort = document.querySelector('input[name=sort]:checked')
+    params.set('sort', sort.dataset.sort)
+    const current = ++request
+    loading = true
+    fetch('?' + params)
+        .then(response => response.json())
+        .then(page => {
+            if (current !== request) return
+            const entries = document.querySelector('div.entries')
+            if (reset) entries.innerHTML = ''
+            entries.insertAdjacentHTML('beforeend',
+                page.entries.map(entry => entry.html).join(''))
+            cursor = page.next
+            loading = false
+            // observing again checks whether more entries are visible
+            observer.unobserve(more)
+            observer.observe(more)
+        })
+}
+
+let more = null
+const observer = new IntersectionObserver(
+    changes => { if (changes[0].isIntersecting) loadEntries(false) },
+    { rootMargin: '1000px' })
+
+window.addEventListener('DOMContentLoaded', () => {
+    more = document.querySelector('div.more')
+    if (more === null) return
+    cursor = more.dataset.next || null
+    observer.observe(more)
+    // filters and sorting are applied by the server
+    for (const input of document.querySelectorAll('input.filter'))
+        input.addEventListener('change', () => loadEntries(true))
+})
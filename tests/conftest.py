@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# modules are imported from the installation directory, and `cfg` reads the
+# configuration on import, so it is written to a temporary directory first
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+config_home = tempfile.mkdtemp()
+os.environ['XDG_CONFIG_HOME'] = config_home
+os.makedirs(os.path.join(config_home, 'idaho'))
+with open(os.path.join(config_home, 'idaho', 'config.yaml'), 'w') as f:
+    f.write("TMDb_API_key: '0123'\n"
+            "sources: {}\n"
+            "video_extensions: ['.mkv', '.mp4']\n"
+            "tmdb_offline: true\n")
@@ -0,0 +1,57 @@
+import os
+
+import media
+from media import Collection, Movie, identities, scan_folder
+from snapshot import snapshots
+
+
+def known_movie(path):
+    # movie with information, indexed by the identity of its video file,
+    # which was last modified long enough ago
+    os.utime(path, (0, 0))
+    movie = Movie(5, path)
+    movie.info = {'uid': 'M5', 'title': 'Title', 'date': '2000-01-01',
+                  'genres': ['Drama']}
+    identities.update(movie)
+    assert movie.identity is not None
+    return movie
+
+
+def test_moved_movie_keeps_information(tmp_path, monkeypatch):
+    monkeypatch.setattr(media.search, 'movie', lambda **kwargs: {
+        'results': [{'id': 5, 'title': 'Title'}]})
+    old = tmp_path / 'Dir - Title - 2000.mkv'
+    old.write_bytes(b'x' * 1000)
+    movie = known_movie(str(old))
+    new = tmp_path / 'Dir - Title (Cut) - 2000.mkv'
+    os.rename(old, new)
+
+    entries = scan_folder(snapshots.get(str(tmp_path)), {}, [],
+                          [media.probe_processed_file_movie], [])
+
+    entry = entries[new.name]
+    assert isinstance(entry, Movie)
+    assert entry.path == str(new)
+    assert entry.info == movie.info
+
+
+def test_moved_movie_does_not_take_over_new_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(media.search, 'movie', lambda **kwargs: {
+        'results': [{'id': 5, 'title': 'Title'}]})
+    old = tmp_path / 'Dir - Title - 2000.mkv'
+    old.write_bytes(b'x' * 1000)
+    movie = known_movie(str(old))
+    folder = tmp_path / 'Saga collection'
+    folder.mkdir()
+    new = folder / old.name
+    os.rename(old, new)
+
+    entries = scan_folder(snapshots.get(str(tmp_path)), {},
+                          [media.probe_processed_folder_collection],
+                          [media.probe_processed_file_movie], [])
+
+    collection = entries[folder.name]
+    assert isinstance(collection, Collection)
+    entry = collection.entries[new.name]
+    assert isinstance(entry, Movie)
+    assert entry.info == movie.info
@@ -0,0 +1,30 @@
+from media import Movie
+from sortedindex import SortedIndex
+
+
+def movie(path, title, date):
+    entry = Movie(1, path)
+    entry.info = {'uid': 'M1', 'title': title, 'date': date,
+                  'genres': ['Drama']}
+    return entry
+
+
+def test_page_of_empty_index():
+    index = SortedIndex()
+    assert index.page(None, 'date', None, None, 10) == ([], None)
+    assert index.page(None, '-name', 'Drama', {'Movie'}, 10) == ([], None)
+    assert index.page(None, 'date', None, None, 0) == ([], None)
+
+
+def test_pages():
+    index = SortedIndex()
+    index.update('/a', [(f'/a/{i}', movie(f'/a/{i}', f'T{i}', f'200{i}'))
+                        for i in range(5)])
+    urls, next = index.page(None, 'date', None, None, 2)
+    assert urls == ['/a/0', '/a/1']
+    urls, next = index.page(next, 'date', None, None, 2)
+    assert urls == ['/a/2', '/a/3']
+    urls, next = index.page(next, 'date', None, None, 2)
+    assert urls == ['/a/4'] and next is None
+    urls, next = index.page(None, '-date', None, None, 3)
+    assert urls == ['/a/4', '/a/3', '/a/2']
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+import requests.adapters
+import tmdbsimple.base
+
+import cfg
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Offline(Exception):
+    # raised in offline mode for a request that is not in the cache
+    pass
+
+
+class ResponseCache:
+    # persistent cache of TMDb responses, keyed by endpoint and parameters
+
+    def __init__(self, filename, ttls, size):
+        # time to live in days, by endpoint or first path component
+        self.ttls = ttls
+        # maximum total size of responses in MB
+        self.size = size * 1e6
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'key TEXT PRIMARY KEY, endpoint TEXT, '
+                        'fetched REAL, used REAL, size INTEGER, body TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_used '
+                        'ON responses (used)')
+        self.total = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def ttl(self, endpoint):
+        # look up time to live in seconds
+        days = self.ttls.get(endpoint,
+                             self.ttls.get(endpoint.split('/')[0], 0))
+        return days * 24 * 60 * 60
+
+    def get(self, path, params, fetch):
+        # get response to request for `path` with `params` from the cache,
+        # or obtain it by calling `fetch` and store it
+        endpoint = re.sub(r'/[0-9]+', '/{id}', path)
+        key = path + '?' + json.dumps(sorted((params or {}).items()))
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                'SELECT fetched, body FROM responses WHERE key = ?',
+                (key,)).fetchone()
+            if row is not None and (cfg.tmdb_offline
+                                    or now - row[0] < self.ttl(endpoint)):
+                self.db.execute('UPDATE responses SET used = ? WHERE key = ?',
+                                (now, key))
+                metrics.tmdb_cache_total.inc(endpoint=endpoint, result='hit')
+                return json.loads(row[1])
+        if cfg.tmdb_offline:
+            raise Offline(f'{path} is not cached')
+        metrics.tmdb_cache_total.inc(endpoint=endpoint, result='miss')
+        response = fetch()
+        body = json.dumps(response)
+        with self.lock:
+            old = self.db.execute('SELECT size FROM responses WHERE key = ?',
+                                  (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO responses '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, endpoint, now, now, len(body), body))
+            self.total += len(body) - (old[0] if old is not None else 0)
+            if self.total > self.size:
+                self.evict()
+        return response
+
+    def evict(self):
+        # remove least recently used responses until 10% below maximum size
+        rows = self.db.execute('SELECT key, size FROM responses '
+                               'ORDER BY used').fetchall()
+        keys = []
+        for key, size in rows:
+            if self.total <= 0.9 * self.size:
+                break
+            keys.append((key,))
+            self.total -= size
+        self.db.executemany('DELETE FROM responses WHERE key = ?', keys)
+        log.info('evicted %d cached TMDb responses', len(keys))
+
+
+class TokenBucket:
+    # limits requests to `rate` per second on average, in bursts of at most
+    # `burst`
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        # time up to which tokens have been added
+        self.time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        # take a token, waiting until one is available
+        with self.lock:
+            now = time.monotonic()
+            if now > self.time:
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.time) * self.rate)
+                self.time = now
+            # a negative number of tokens reserves future ones
+            self.tokens -= 1
+            wait = self.time - now + max(0, -self.tokens) / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # don't give out tokens for `seconds`
+        with self.lock:
+            self.time = max(self.time, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0)
+
+
+class Client:
+    # HTTP client for TMDb's API, with a pool of keep-alive connections, a
+    # rate limit, and retries with backoff on status 429 (too many requests),
+    # server errors and connection errors
+
+    def __init__(self, base_url, rate, connections, retries=5):
+        self.base_url = base_url
+        self.retries = retries
+        self.bucket = TokenBucket(rate, rate)
+        self.session = requests.Session()
+        # threads beyond `connections` wait for a free one, so that
+        # connections are kept rather than discarded
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=connections,
+                                                pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, path, params):
+        params = dict(params or {}, api_key=tmdbsimple.API_KEY)
+        params = {key: (('true' if value else 'false')
+                        if isinstance(value, bool) else value)
+                  for key, value in params.items()}
+        endpoint = re.sub(r'/[0-9]+', '/{id}', path)
+        for attempt in range(self.retries + 1):
+            # seconds to wait before next attempt
+            backoff = 2 ** attempt
+            self.bucket.take()
+            try:
+                with metrics.tmdb_request_seconds.time(endpoint=endpoint):
+                    response = self.session.get(f'{self.base_url}/{path}',
+                                                params=params, timeout=30)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                log.warning('TMDb request failed, retrying: %s', e,
+                            extra={'endpoint': endpoint})
+                time.sleep(backoff)
+                continue
+            if (response.status_code == 429 or response.status_code >= 500) \
+                    and attempt < self.retries:
+                try:
+                    backoff = float(response.headers['Retry-After'])
+                except (KeyError, ValueError):
+                    pass
+                log.warning('TMDb status %d, retrying in %s s',
+                            response.status_code, backoff,
+                            extra={'endpoint': endpoint,
+                                   'status': response.status_code,
+                                   'seconds': backoff})
+                if response.status_code == 429:
+                    # hold back all requests
+                    self.bucket.pause(backoff)
+                else:
+                    time.sleep(backoff)
+                continue
+            response.raise_for_status()
+            response.encoding = 'utf-8'
+            return response.json()
+
+
+cache = ResponseCache(os.path.join(cfg.dir, 'tmdb_cache.db'),
+                      cfg.tmdb_cache_ttl, cfg.tmdb_cache_size)
+
+# TMDb is used by the scan workers, and directly by the threads of sources,
+# jobs and web requests
+client = Client(cfg.tmdb_base_url, cfg.tmdb_rate_limit,
+                cfg.scan_workers + len(cfg.sources) + 2)
+
+
+# route all of tmdbsimple's GET requests through the cache and the client
+def cached_GET(self, path, params=None):
+    return cache.get(path, params, lambda: client.get(path, params))
+
+
+tmdbsimple.base.TMDB._GET = cached_GET
@@ -0,0 +1,212 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+import cfg
+import jobs
+from media import Collection, Series, Season, folder_fingerprint, \
+    series_memo, walk
+
+log = logging.getLogger(__name__)
+
+
+class Inotify:
+    # minimal interface to Linux' inotify via libc
+
+    # watch descriptor of the event reporting that events have been lost
+    # because the queue overflowed (IN_Q_OVERFLOW)
+    overflow_wd = -1
+
+    # events that change the names within a folder, or the folder itself
+    mask = (0x00000100      # IN_CREATE
+            | 0x00000200    # IN_DELETE
+            | 0x00000040    # IN_MOVED_FROM
+            | 0x00000080    # IN_MOVED_TO
+            | 0x00000400    # IN_DELETE_SELF
+            | 0x00000800)   # IN_MOVE_SELF
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path):
+        # returns watch descriptor, or raises `OSError` e.g. if the maximum
+        # number of watches is reached
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                         self.mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        # get watch descriptors of events, waiting at most `timeout` seconds
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return []
+        data = os.read(self.fd, 65536)
+        wds = []
+        pos = 0
+        while pos < len(data):
+            wd, _, _, length = struct.unpack_from('iIII', data, pos)
+            wds.append(wd)
+            pos += 16 + length
+        return wds
+
+
+class Watcher:
+    # Watches the folders of all collections, series and seasons and updates
+    # the corresponding entries when names are added, removed or renamed.
+    # Folders that can't be watched by inotify are polled by comparing their
+    # fingerprints.
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.inotify = None
+        if cfg.watch != 'poll':
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                # no inotify on this system
+                log.warning('inotify unavailable, polling: %s', e)
+        # inotify watch descriptors by path and paths by watch descriptor
+        self.wds = dict()
+        self.paths = dict()
+        # folders that are polled, and their fingerprints at the last poll
+        self.polled = set()
+        self.polled_fingerprints = dict()
+        # folders with changes, and time of the last change
+        self.pending = set()
+        self.changed = 0
+        # whether inotify events have been lost
+        self.overflow = False
+
+    def start(self):
+        threading.Thread(target=self.run, name='watcher', daemon=True).start()
+
+    def run(self):
+        # wait for the initial revalidation, then watch
+        self.sources.revalidated.wait()
+        containers = self.update_watches()
+        polled = time.monotonic()
+        while True:
+            if self.inotify is not None:
+                events = self.inotify.read(1)
+            else:
+                time.sleep(1)
+                events = []
+            now = time.monotonic()
+            for wd in events:
+                if wd in self.paths:
+                    self.pending.add(self.paths[wd])
+                    self.changed = now
+                elif wd == Inotify.overflow_wd:
+                    log.warning('inotify events lost, revalidating')
+                    self.overflow = True
+                    self.changed = now
+            if now - polled >= cfg.watch_interval:
+                polled = now
+                for path in self.polled:
+                    try:
+                        fingerprint = folder_fingerprint(path)
+                    except OSError:
+                        fingerprint = None
+                    if (fingerprint != containers[path].fingerprint
+                            and fingerprint != self.polled_fingerprints.get(
+                                path)):
+                        self.pending.add(path)
+                        self.changed = now
+                    self.polled_fingerprints[path] = fingerprint
+            # debounce: wait until a burst of changes is over
+            if ((self.pending or self.overflow)
+                    and (now - self.changed >= cfg.watch_delay)):
+                if self.overflow:
+                    self.revalidate()
+                else:
+                    self.update(containers)
+                containers = self.update_watches()
+
+    def update(self, containers):
+        # update entries of changed folders, outer ones first, so that
+        # folders within them are rescanned only once
+        pending = sorted(self.pending, key=len)
+        self.pending = set()
+        for path in pending:
+            if path in containers:
+                self.run_job(containers[path],
+                             lambda container=containers[path]:
+                             self.rescan(container))
+        self.sources.save_soon()
+
+    def rescan(self, container):
+        log.info('change in %s', container)
+        try:
+            with series_memo.scope():
+                container.add_info()
+        except OSError as e:
+            # folder removed, its container takes care of it
+            log.warning('%s', e)
+            return
+        self.sources.entry_changed(container)
+
+    def revalidate(self):
+        # revalidate all sources, after events have been lost
+        self.overflow = False
+        self.pending = set()
+        for source in self.sources.each_source():
+            self.run_job(source, lambda source=source:
+                         self.sources.revalidate_source(source))
+
+    def run_job(self, entry, function):
+        # Run `function` as a job for `entry` and wait for it, so that it
+        # doesn't interleave with a refresh of the same entry, which is
+        # submitted for the URL path of its page. If one is running already,
+        # the folder is updated again afterwards.
+        url, _ = self.sources.locate(entry)
+        if url is None:
+            return
+        job = jobs.runner.submit(url + '/', function)
+        if job.function is not function:
+            self.pending.add(entry.path)
+            return
+        with job.changed:
+            job.changed.wait_for(lambda: job.done)
+
+    def update_watches(self):
+        # watch or poll the folders of all containers, return containers by
+        # path
+        containers = {entry.path: entry
+                      for source in self.sources.each_source()
+                      for _, _, entry in walk(source)
+                      if isinstance(entry, (Collection, Series, Season))}
+        for path in set(self.wds) - set(containers):
+            self.inotify.rm_watch(self.wds[path])
+            del self.paths[self.wds.pop(path)]
+        self.polled &= set(containers)
+        self.polled_fingerprints = {path: fingerprint for path, fingerprint
+                                    in self.polled_fingerprints.items()
+                                    if path in self.polled}
+        for path in set(containers) - set(self.wds) - self.polled:
+            if self.inotify is not None:
+                try:
+                    wd = self.inotify.add_watch(path)
+                    self.wds[path] = wd
+                    self.paths[wd] = path
+                    continue
+                except OSError as e:
+                    log.warning('cannot watch, polling: %s', e)
+            self.polled.add(path)
+        log.info('watching %d and polling %d folders', len(self.wds),
+                 len(self.polled))
+        return containers